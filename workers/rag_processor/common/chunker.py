@@ -1,17 +1,21 @@
-from typing import List, Dict
+from typing import List, Dict, Union
+import os
+import threading
 import numpy as np
 import logging
+import semchunk
 from sentence_splitter import split_text_into_sentences
-from workers.rag_processor.common.embedder import JinaEmbedder
+from workers.rag_processor.common.embedder import DiskCachedEmbedder
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 class SemanticChunker:
-    def __init__(self, similarity_threshold: float = 0.85, language: str = 'en'):
-        self.embedder = JinaEmbedder()
+    def __init__(self, similarity_threshold: float = 0.85, language: str = 'en', batch_size: int = 256):
+        self.embedder = DiskCachedEmbedder()
         self.similarity_threshold = similarity_threshold
         self.language = language
+        self.batch_size = batch_size
         self.embedding_dim = self.embedder.get_embedding_dimension()
         logger.debug(f"SemanticChunker initialized with language={language}, embedding_dim={self.embedding_dim}")
 
@@ -50,24 +54,24 @@ class SemanticChunker:
         try:
             chunks = []
             current_chunk = [sentences[0]]
-            current_embedding = embeddings[0].flatten()
+            # Running sum of the chunk's sentence embeddings; it points the same way as
+            # their mean, so cosine similarity is unchanged without re-averaging each step
+            chunk_sum = np.array(embeddings[0], dtype=np.float64).flatten()
 
             for i in range(1, len(sentences)):
                 next_embedding = embeddings[i].flatten()
                 
                 # Calculate similarity with current chunk
-                similarity = self._cosine_similarity(current_embedding, next_embedding)
+                similarity = self._cosine_similarity(chunk_sum, next_embedding)
                 logger.debug(f"Similarity between chunk and sentence {i}: {similarity}")
                 
                 if similarity >= self.similarity_threshold:
                     current_chunk.append(sentences[i])
-                    # Update current embedding as average of all sentences in chunk
-                    chunk_embeddings = [emb.flatten() for emb in embeddings[i - len(current_chunk) + 1:i + 1]]
-                    current_embedding = np.mean(chunk_embeddings, axis=0)
+                    chunk_sum += next_embedding
                 else:
                     chunks.append(" ".join(current_chunk))
                     current_chunk = [sentences[i]]
-                    current_embedding = next_embedding
+                    chunk_sum = np.array(next_embedding, dtype=np.float64)
 
             if current_chunk:
                 chunks.append(" ".join(current_chunk))
@@ -80,52 +84,118 @@ class SemanticChunker:
 
     def chunk_text(self, text: str) -> List[str]:
         """Split text into semantic chunks"""
-        try:
-            # Split text into sentences
-            sentences = split_text_into_sentences(text, language=self.language)
-            logger.debug(f"Split text into {len(sentences)} sentences")
-            
-            if not sentences:
-                return []
-
-            # Get embeddings for all sentences
-            embeddings = []
-            for i, sentence in enumerate(sentences):
-                try:
-                    embedding = self.embedder.embed_text(sentence)
-                    # Ensure embedding has correct dimension
-                    if embedding.shape[0] != self.embedding_dim:
-                        logger.warning(f"Embedding for sentence {i} has wrong dimension: {embedding.shape}, expected {self.embedding_dim}")
-                        if embedding.shape[0] > self.embedding_dim:
-                            embedding = embedding[:self.embedding_dim]
-                        else:
-                            embedding = np.pad(embedding, (0, self.embedding_dim - embedding.shape[0]))
-                    embeddings.append(embedding)
-                except Exception as e:
-                    logger.error(f"Error embedding sentence {i}: {str(e)}")
-                    # Use zero vector as fallback
-                    embeddings.append(np.zeros(self.embedding_dim))
-            
-            # Merge similar sentences into chunks
-            chunks = self._merge_similar_sentences(sentences, embeddings)
-            logger.debug(f"Created {len(chunks)} chunks")
-            
-            return chunks
-        except Exception as e:
-            logger.error(f"Error chunking text: {str(e)}")
-            return [text]  # Return original text as single chunk if chunking fails
+        return self.chunk_texts([text])[0]
+
+    def chunk_texts(self, texts: List[str]) -> List[List[str]]:
+        """Split several texts into semantic chunks using one batched embedding call"""
+        # Split every text into sentences up front
+        sentences_per_text = []
+        for text in texts:
+            try:
+                sentences = split_text_into_sentences(text, language=self.language)
+            except Exception as e:
+                logger.error(f"Error splitting text into sentences: {str(e)}")
+                sentences = [text]
+            sentences_per_text.append(sentences)
+
+        all_sentences = [sentence for sentences in sentences_per_text for sentence in sentences]
+        logger.debug(f"Split {len(texts)} texts into {len(all_sentences)} sentences")
+        if not all_sentences:
+            return [[] for _ in texts]
+
+        # Embed the sentences of all texts together so the model sees full batches
+        embeddings = self.embedder.embed_batch(all_sentences, batch_size=self.batch_size)
+
+        # Partition embeddings back per text and merge similar sentences
+        results = []
+        offset = 0
+        for text, sentences in zip(texts, sentences_per_text):
+            text_embeddings = embeddings[offset:offset + len(sentences)]
+            offset += len(sentences)
+            try:
+                chunks = self._merge_similar_sentences(sentences, text_embeddings)
+                logger.debug(f"Created {len(chunks)} chunks")
+                results.append(chunks)
+            except Exception as e:
+                logger.error(f"Error chunking text: {str(e)}")
+                results.append([text])  # Return original text as single chunk if chunking fails
+
+        return results
 
     def chunk_with_metadata(self, text: str, metadata: Dict) -> List[Dict]:
         """Split text into chunks and attach metadata to each chunk"""
+        return self.chunk_with_metadata_batch([text], [metadata])
+
+    def chunk_with_metadata_batch(self, texts: List[str], metadatas: List[Dict]) -> List[Dict]:
+        """Split several texts into chunks and attach each text's metadata to its chunks"""
         try:
-            chunks = self.chunk_text(text)
+            chunks_per_text = self.chunk_texts(texts)
             return [
                 {
                     "text": chunk,
                     "metadata": metadata
                 }
+                for chunks, metadata in zip(chunks_per_text, metadatas)
                 for chunk in chunks
             ]
         except Exception as e:
             logger.error(f"Error chunking with metadata: {str(e)}")
-            return [{"text": text, "metadata": metadata}] 
\ No newline at end of file
+            return [
+                {"text": text, "metadata": metadata}
+                for text, metadata in zip(texts, metadatas)
+            ]
+
+
+class RecursiveChunker:
+    """Token-bounded recursive splitter for long texts, backed by semchunk"""
+
+    def __init__(self, chunk_size: int = 512):
+        self.embedder = DiskCachedEmbedder()
+        self.chunk_size = chunk_size
+        # Each worker thread gets its own tokenizer copy, since HF fast tokenizers are not thread-safe
+        self._local = threading.local()
+        logger.debug(f"RecursiveChunker initialized with chunk_size={chunk_size}")
+
+    def _get_chunker(self):
+        """Get this thread's semchunk chunker, building it on first use"""
+        chunker = getattr(self._local, "chunker", None)
+        if chunker is None:
+            # Count tokens with the embedding model's own tokenizer so chunks fit its window
+            chunker = semchunk.chunkerify(self.embedder.get_tokenizer(), chunk_size=self.chunk_size)
+            self._local.chunker = chunker
+        return chunker
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Split text into token-bounded chunks"""
+        return self.chunk_texts([text])[0]
+
+    def chunk_texts(self, texts: List[str]) -> List[List[str]]:
+        """Split several texts into token-bounded chunks"""
+        try:
+            return self._get_chunker()(texts)
+        except Exception as e:
+            logger.error(f"Error chunking texts: {str(e)}")
+            return [[text] for text in texts]  # Return original texts as single chunks if chunking fails
+
+    def chunk_with_metadata(self, text: str, metadata: Dict) -> List[Dict]:
+        """Split text into chunks and attach metadata to each chunk"""
+        return self.chunk_with_metadata_batch([text], [metadata])
+
+    def chunk_with_metadata_batch(self, texts: List[str], metadatas: List[Dict]) -> List[Dict]:
+        """Split several texts into chunks and attach each text's metadata to its chunks"""
+        return [
+            {
+                "text": chunk,
+                "metadata": metadata
+            }
+            for chunks, metadata in zip(self.chunk_texts(texts), metadatas)
+            for chunk in chunks
+        ]
+
+
+def create_chunker(language: str = 'en') -> Union[RecursiveChunker, SemanticChunker]:
+    """Create the chunker selected by the RAG_CHUNKER environment variable"""
+    chunker_type = os.getenv("RAG_CHUNKER", "recursive").lower()
+    if chunker_type == "semantic":
+        return SemanticChunker(language=language)
+    return RecursiveChunker(chunk_size=int(os.getenv("RAG_CHUNK_SIZE", "512")))
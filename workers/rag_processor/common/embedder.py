@@ -1,9 +1,14 @@
 import os
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 import torch
 import logging
+import diskcache
 from sentence_transformers import SentenceTransformer
-from typing import List, Union
+from typing import List, Optional, Union
 from dotenv import load_dotenv
 
 # Configure logging
@@ -16,13 +21,18 @@ os.environ["FLASH_ATTENTION_FORCE_DISABLED"] = "1"
 
 class JinaEmbedder:
     _instance = None
+    _instance_lock = threading.Lock()
     _model = None
     _embedding_dim = None
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(JinaEmbedder, cls).__new__(cls)
-            cls._instance._initialize()
+            with cls._instance_lock:
+                # Only publish the instance once it is fully initialized
+                if cls._instance is None:
+                    instance = super(JinaEmbedder, cls).__new__(cls)
+                    instance._initialize()
+                    cls._instance = instance
         return cls._instance
 
     def _initialize(self):
@@ -44,6 +54,8 @@ class JinaEmbedder:
                 trust_remote_code=True
             )
             self._embedding_dim = self._model.get_sentence_embedding_dimension()
+            # encode() reconfigures the shared fast tokenizer, so calls from several threads must not overlap
+            self._model_lock = threading.Lock()
             logger.info(f"Initialized JinaEmbedder with dimension {self._embedding_dim}")
 
         except Exception as e:
@@ -54,6 +66,11 @@ class JinaEmbedder:
         """Get the dimension of the embeddings"""
         return self._embedding_dim
 
+    def get_tokenizer(self):
+        """Get a private copy of the model's tokenizer that is safe to use alongside the model"""
+        with self._model_lock:
+            return copy.deepcopy(self._model.tokenizer)
+
     def embed_text(self, text: str) -> np.ndarray:
         """Embed a single text string with safety checks and normalization."""
         try:
@@ -62,7 +79,8 @@ class JinaEmbedder:
                 logger.warning("Empty text received for embedding.")
                 return np.zeros(self._embedding_dim)
 
-            embedding = self._model.encode(text, convert_to_numpy=True, truncate=False)
+            with self._model_lock:
+                embedding = self._model.encode(text, convert_to_numpy=True, truncate=False)
 
             if embedding.shape != (self._embedding_dim,):
                 logger.warning(f"Unexpected embedding shape: {embedding.shape}")
@@ -81,11 +99,17 @@ class JinaEmbedder:
             return np.zeros(self._embedding_dim)
 
 
-    def embed_batch(self, texts: List[str]) -> List[np.ndarray]:
+    def embed_batch(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
         """Embed a list of texts with validation and normalization."""
         try:
             clean_texts = [t.strip() if t else "" for t in texts]
-            embeddings = self._model.encode(clean_texts, convert_to_numpy=True, truncate=False)
+            with self._model_lock:
+                embeddings = self._model.encode(
+                    clean_texts,
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                    truncate=False
+                )
 
             final_embeddings = []
             for i, emb in enumerate(embeddings):
@@ -105,5 +129,123 @@ class JinaEmbedder:
             return final_embeddings
 
         except Exception as e:
+            # Raise rather than return zero vectors, which would be uploaded as real embeddings
             logger.error(f"Error embedding batch: {str(e)}")
-            return [np.zeros(self._embedding_dim) for _ in texts]
+            raise
+
+
+class DiskCachedEmbedder:
+    """JinaEmbedder wrapper that caches embeddings by content hash.
+
+    Lookups go through an in-process LRU first and a persistent disk cache
+    second, so only texts that were never embedded before reach the model.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                # Only publish the instance once it is fully initialized
+                if cls._instance is None:
+                    instance = super(DiskCachedEmbedder, cls).__new__(cls)
+                    instance._initialize()
+                    cls._instance = instance
+        return cls._instance
+
+    def _initialize(self):
+        """Initialize the wrapped embedder and both cache layers"""
+        self.embedder = JinaEmbedder()
+        self._embedding_dim = self.embedder.get_embedding_dimension()
+
+        self.cache_dir = os.getenv(
+            "RAG_EMBEDDING_CACHE_DIR",
+            os.path.join(os.path.expanduser("~"), ".cache", "rag_embeddings")
+        )
+        self._disk_cache = diskcache.Cache(self.cache_dir)
+
+        self._memory_cache_size = int(os.getenv("RAG_EMBEDDING_MEMORY_CACHE_SIZE", "50000"))
+        self._memory_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        logger.info(f"Initialized DiskCachedEmbedder with cache dir {self.cache_dir}")
+
+    def _cache_key(self, text: str) -> str:
+        """Hash the model name and text into a cache key"""
+        return hashlib.sha256(f"{self.embedder.model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def _get_cached(self, key: str) -> Optional[np.ndarray]:
+        """Look up an embedding in memory, then on disk"""
+        with self._lock:
+            embedding = self._memory_cache.get(key)
+            if embedding is not None:
+                self._memory_cache.move_to_end(key)
+                return embedding
+
+        stored = self._disk_cache.get(key)
+        if stored is None:
+            return None
+
+        embedding = stored.astype(np.float32)
+        self._remember(key, embedding)
+        return embedding
+
+    def _remember(self, key: str, embedding: np.ndarray):
+        """Store an embedding in the in-process LRU"""
+        with self._lock:
+            self._memory_cache[key] = embedding
+            self._memory_cache.move_to_end(key)
+            while len(self._memory_cache) > self._memory_cache_size:
+                self._memory_cache.popitem(last=False)
+
+    def get_embedding_dimension(self) -> int:
+        """Get the dimension of the embeddings"""
+        return self._embedding_dim
+
+    def get_tokenizer(self):
+        """Get a private copy of the underlying model's tokenizer"""
+        return self.embedder.get_tokenizer()
+
+    def embed_text(self, text: str) -> np.ndarray:
+        """Embed a single text string, reusing a cached embedding when available."""
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        """Embed a list of texts, sending only cache misses to the model."""
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        miss_indices = []
+        miss_keys = []
+        miss_texts = []
+
+        for i, text in enumerate(texts):
+            clean_text = text.strip() if text else ""
+            if not clean_text:
+                results[i] = np.zeros(self._embedding_dim)
+                continue
+
+            key = self._cache_key(clean_text)
+            embedding = self._get_cached(key)
+            if embedding is not None:
+                results[i] = embedding
+                continue
+
+            miss_indices.append(i)
+            miss_keys.append(key)
+            miss_texts.append(clean_text)
+
+        logger.debug(f"Embedding cache: {len(texts) - len(miss_texts)} hits, {len(miss_texts)} misses")
+
+        if miss_texts:
+            embeddings = self.embedder.embed_batch(miss_texts, batch_size=batch_size)
+            for i, key, embedding in zip(miss_indices, miss_keys, embeddings):
+                results[i] = embedding
+                # Zero vectors signal an embedding failure and must not be cached
+                if not np.any(embedding):
+                    continue
+                embedding = embedding.astype(np.float32)
+                self._remember(key, embedding)
+                try:
+                    self._disk_cache.set(key, embedding.astype(np.float16))
+                except Exception as e:
+                    logger.warning(f"Error writing embedding to disk cache: {str(e)}")
+
+        return results
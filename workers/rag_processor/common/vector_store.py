@@ -1,19 +1,40 @@
 from qdrant_client import QdrantClient
 from qdrant_client.models import (
-    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue,
+    OptimizersConfigDiff, ScalarQuantization, ScalarQuantizationConfig, ScalarType, VectorParamsDiff
 )
 from typing import List, Dict, Optional
 from datetime import datetime
 import numpy as np
 import os
+import threading
 import uuid
-from workers.rag_processor.common.embedder import JinaEmbedder
+from workers.rag_processor.common.embedder import DiskCachedEmbedder
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Number of documents sent to Qdrant per upsert
+VECTOR_UPLOAD_BATCH_SIZE = int(os.getenv("VECTOR_UPLOAD_BATCH_SIZE", "64"))
+# Number of upserts allowed in flight at the same time
+VECTOR_UPLOAD_CONCURRENCY = int(os.getenv("VECTOR_UPLOAD_CONCURRENCY", "2"))
+# Vectors are kept as int8 in RAM for search; float32 originals live on disk for rescoring
+INT8_QUANTIZATION = ScalarQuantization(
+    scalar=ScalarQuantizationConfig(
+        type=ScalarType.INT8,
+        always_ram=True
+    )
+)
+# Qdrant indexing threshold (KB) restored after a bulk load when none is configured
+QDRANT_INDEXING_THRESHOLD = int(os.getenv("QDRANT_INDEXING_THRESHOLD", "20000"))
+
 class VectorStore:
+    # Bulk loads are shared by every VectorStore in the process since they target one collection
+    _bulk_lock = threading.Lock()
+    _bulk_depth = 0
+    _saved_indexing_threshold = QDRANT_INDEXING_THRESHOLD
+
     def __init__(self):
         """Initialize Qdrant client and embedding model"""
         self.host = os.getenv("QDRANT_HOST", "localhost")
@@ -22,7 +43,7 @@ class VectorStore:
         self.collection_name = "rag_data"
 
         # Initialize embedding model
-        self.embedder = JinaEmbedder()
+        self.embedder = DiskCachedEmbedder()
         embedding_dim = self.embedder.get_embedding_dimension()
 
         # Initialize Qdrant client
@@ -37,8 +58,10 @@ class VectorStore:
                 collection_name=self.collection_name,
                 vectors_config=VectorParams(
                     size=embedding_dim,  # Use dimension from Jina model
-                    distance=Distance.COSINE
-                )
+                    distance=Distance.COSINE,
+                    on_disk=True  # Only the int8 copy is held in RAM
+                ),
+                quantization_config=INT8_QUANTIZATION
             )
 
             self.client.create_payload_index(
@@ -47,6 +70,22 @@ class VectorStore:
                 field_schema="integer"
             )
 
+        else:
+            # Enable int8 quantization on collections created before it was configured
+            info = self.client.get_collection(collection_name=self.collection_name)
+            if info.config.quantization_config is None:
+                self.client.update_collection(
+                    collection_name=self.collection_name,
+                    quantization_config=INT8_QUANTIZATION
+                )
+            # Move float32 originals out of RAM so quantization actually saves memory
+            vectors = info.config.params.vectors
+            if isinstance(vectors, VectorParams) and not vectors.on_disk:
+                self.client.update_collection(
+                    collection_name=self.collection_name,
+                    vectors_config={"": VectorParamsDiff(on_disk=True)}
+                )
+
         self.client.delete_payload_index(
             collection_name="rag_data",
             field_name="post_id"
@@ -58,26 +97,36 @@ class VectorStore:
             field_schema="integer"
         )
 
+    def _build_points(self, documents: List[Dict]) -> List[PointStruct]:
+        """Embed documents and build Qdrant points"""
+        texts = [doc["text"] for doc in documents]
+        metadatas = [doc["metadata"] for doc in documents]
+
+        # Generate embeddings using the model
+        vectors = self.embedder.embed_batch(texts)
+
+        points = []
+        for vector, metadata, text in zip(vectors, metadatas, texts):
+            # Zero vectors stand for empty or unembeddable texts and would only pollute search
+            if not np.any(vector):
+                print(f"Skipping document without a usable embedding: {text[:50]!r}")
+                continue
+            points.append(PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_DNS, text)),
+                vector=np.asarray(vector, dtype=np.float32).tolist(),
+                payload={**metadata, "text": text}
+            ))
+        return points
+
     def add_documents(self, documents: List[Dict]):
         """Add documents to the vector store"""
         if not documents:
             return
 
         try:
-            texts = [doc["text"] for doc in documents]
-            metadatas = [doc["metadata"] for doc in documents]
-
-            # Generate embeddings using the model
-            vectors = self.embedder.embed_batch(texts)
-
-            points = [
-                PointStruct(
-                    id=str(uuid.uuid5(uuid.NAMESPACE_DNS, text)),
-                    vector=vector,
-                    payload={**metadata, "text": text}
-                )
-                for vector, metadata, text in zip(vectors, metadatas, texts)
-            ]
+            points = self._build_points(documents)
+            if not points:
+                return
 
             self.client.upsert(
                 collection_name=self.collection_name,
@@ -89,6 +138,66 @@ class VectorStore:
             print(f"Error adding documents: {str(e)}")
             raise
 
+    def add_documents_bulk(self, documents: List[Dict]):
+        """Add documents without waiting for Qdrant to apply them, for backfills"""
+        if not documents:
+            return
+
+        try:
+            points = self._build_points(documents)
+            if not points:
+                return
+
+            self.client.upsert(
+                collection_name=self.collection_name,
+                points=points,
+                wait=False
+            )
+            print(f"Successfully queued {len(points)} documents to Qdrant")
+
+        except Exception as e:
+            print(f"Error bulk adding documents: {str(e)}")
+            raise
+
+    def begin_bulk(self):
+        """Disable HNSW index builds on the collection until end_bulk is called"""
+        with VectorStore._bulk_lock:
+            if VectorStore._bulk_depth > 0:
+                # Another loader in this process already disabled indexing
+                VectorStore._bulk_depth += 1
+                return
+
+            info = self.client.get_collection(collection_name=self.collection_name)
+            threshold = info.config.optimizer_config.indexing_threshold
+            # A threshold of 0 means a previous bulk load never finished; fall back to the default
+            VectorStore._saved_indexing_threshold = threshold or QDRANT_INDEXING_THRESHOLD
+
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=0)
+            )
+            # Only count this loader once indexing is actually off, so a failed call leaves nothing for end_bulk to undo
+            VectorStore._bulk_depth += 1
+            print(f"Disabled indexing for bulk load (threshold was {VectorStore._saved_indexing_threshold})")
+
+    def end_bulk(self):
+        """Restore the indexing threshold so Qdrant builds the index in one optimizer pass"""
+        with VectorStore._bulk_lock:
+            if VectorStore._bulk_depth == 0:
+                return
+            VectorStore._bulk_depth -= 1
+            if VectorStore._bulk_depth > 0:
+                # Other loaders in this process are still running
+                return
+
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                optimizers_config=OptimizersConfigDiff(
+                    indexing_threshold=VectorStore._saved_indexing_threshold
+                )
+            )
+            print(f"Re-enabled indexing after bulk load (threshold {VectorStore._saved_indexing_threshold})")
+
     def get_by_source(self, source: str, limit: int = 100) -> List[Dict]:
         """Get documents by source"""
         try:
@@ -131,7 +240,8 @@ class VectorStore:
             return {
                 "total_documents": info.points_count,
                 "vector_size": info.config.params.vectors.size,
-                "distance": info.config.params.vectors.distance
+                "distance": info.config.params.vectors.distance,
+                "quantization": info.config.quantization_config
             }
         except Exception as e:
             print(f"Error getting collection stats: {str(e)}")
@@ -1,11 +1,17 @@
-from datetime import datetime
-from typing import List, Dict, Optional
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Tuple
 import os
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from workers.rag_processor.common.chunker import SemanticChunker
-from workers.rag_processor.common.vector_store import VectorStore
+from pymongo import ASCENDING, MongoClient
+from workers.rag_processor.common.chunker import create_chunker
+from workers.rag_processor.common.vector_store import (
+    VectorStore, VECTOR_UPLOAD_BATCH_SIZE, VECTOR_UPLOAD_CONCURRENCY
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -13,153 +19,212 @@ logger = logging.getLogger(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
+# Texts longer than this are split into chunks
+MAX_TEXT_LENGTH = 10000
+# Metadata fields shared by every Telegram document
+TELEGRAM_METADATA_DEFAULTS = {
+    "source": "telegram",
+}
+# Number of messages fetched from MongoDB and processed per batch
+MONGO_BATCH_SIZE = 500
+# Only the fields read by _prepare_message are fetched from MongoDB
+MESSAGE_PROJECTION = {
+    "message": 1,
+    "timestamp": 1,
+    "chat_id": 1,
+    "chat_type": 1,
+    "metadata.user_name": 1,
+    "metadata.user_full_name": 1,
+    "metadata.message_type": 1,
+    "metadata.is_reply": 1,
+    "metadata.reply_to_message_id": 1,
+    "metadata.reply_to_user_id": 1,
+}
+# Index on the materialized BSON Date of timestamp.date
+TIMESTAMP_DATE_INDEX = "timestamp_date_1"
+
 class TelegramProcessor:
     def __init__(self, mongo_uri: str = None, db_name: str = None):
         """Initialize MongoDB client with environment variables"""
         self.client = MongoClient(mongo_uri or os.getenv('TELE_MONGODB_URI', 'mongodb://localhost:27017'))
         self.db = self.client[db_name or os.getenv('TELE_MONGODB_DB_NAME', 'telegram_db')]
         self.messages_collection = self.db["chat_history"]
-        self.chunker = SemanticChunker(language='en')  # Use English for sentence splitting
+        self.messages_collection.create_index([("timestamp_date", ASCENDING)], name=TIMESTAMP_DATE_INDEX)
+        self.chunker = create_chunker(language='en')  # Use English for sentence splitting
         self.vector_store = VectorStore()
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=VECTOR_UPLOAD_CONCURRENCY,
+            thread_name_prefix="telegram-rag-upload"
+        )
         logger.info("TelegramProcessor initialized")
 
-    def _get_safe_value(self, value: any, default: any = '') -> any:
-        """Get a safe value for metadata, replacing None with default"""
-        return value if value is not None else default
-
-    def _process_message(self, message: Dict) -> List[Dict]:
-        """Process a single message into chunks with metadata"""
+    def _prepare_message(self, message: Dict) -> Optional[Tuple[str, Dict]]:
+        """Extract text and metadata from a single message"""
+        message_id = message.get('_id')
         try:
-            text = message.get('message', '')
+            text = message.get('message') or ''
             if not text:
-                logger.debug(f"Skipping message {message.get('_id', 'unknown')} - empty text")
-                return []
+                logger.debug(f"Skipping message {message_id or 'unknown'} - empty text")
+                return None
 
             # Extract timestamp from MongoDB ISODate format
-            timestamp = message.get('timestamp', {})
-            if isinstance(timestamp, dict) and '$date' in timestamp:
-                timestamp = int(timestamp['$date'])
-            else:
-                timestamp = int(datetime.now().timestamp())
-            
-            message_time = message.get('timestamp', {})
-            if isinstance(message_time, dict) and '$date' in message_time:
-                message_time = message_time['$date']
+            raw_timestamp = message.get('timestamp')
+            if isinstance(raw_timestamp, dict) and '$date' in raw_timestamp:
+                message_time = raw_timestamp['$date']
+                timestamp = int(message_time)
             else:
-                message_time = datetime.now().isoformat()
+                now = datetime.now()
+                message_time = now.isoformat()
+                timestamp = int(now.timestamp())
 
             # Get metadata with safe values
-            metadata = message.get('metadata', {})
-            metadata_dict = {
-                "source": "telegram",
-                "message_id": str(message.get('_id', '')),
+            metadata = message.get('metadata') or {}
+            metadata_dict = TELEGRAM_METADATA_DEFAULTS | {
+                "message_id": str(message_id or ''),
                 "message_time": message_time,
-                "sender": self._get_safe_value(metadata.get('user_name')),
-                "sender_full_name": self._get_safe_value(metadata.get('user_full_name')),
-                "chat_id": str(message.get('chat_id', '')),
-                "chat_type": self._get_safe_value(message.get('chat_type')),
+                "sender": metadata.get('user_name') or '',
+                "sender_full_name": metadata.get('user_full_name') or '',
+                "chat_id": str(message.get('chat_id') or ''),
+                "chat_type": message.get('chat_type') or '',
                 "timestamp": timestamp,
-                "message_type": self._get_safe_value(metadata.get('message_type')),
-                "is_reply": bool(metadata.get('is_reply', False)),
-                "reply_to_message_id": self._get_safe_value(metadata.get('reply_to_message_id')),
-                "reply_to_user_id": self._get_safe_value(metadata.get('reply_to_user_id')),
+                "message_type": metadata.get('message_type') or '',
+                "is_reply": bool(metadata.get('is_reply')),
+                "reply_to_message_id": metadata.get('reply_to_message_id') or '',
+                "reply_to_user_id": metadata.get('reply_to_user_id') or '',
                 "original_text": text  # Store original text in metadata
             }
+            return text, metadata_dict
+        except Exception as e:
+            logger.error(f"Error processing message {message_id or 'unknown'}: {str(e)}")
+            return None
 
-            # Only chunk if text is longer than 10000 characters
-            MAX_TEXT_LENGTH = 10000
+    def _build_documents(self, messages: List[Dict]) -> List[Dict]:
+        """Turn messages into vector store documents, chunking long texts in one batch"""
+        documents = []
+        long_texts = []
+        long_metadatas = []
+        for message in messages:
+            prepared = self._prepare_message(message)
+            if prepared is None:
+                continue
+            text, metadata = prepared
+            # Only chunk if text is longer than MAX_TEXT_LENGTH characters
             if len(text) > MAX_TEXT_LENGTH:
-                logger.info(f"Text length {len(text)} exceeds {MAX_TEXT_LENGTH}, chunking...")
-                return self.chunker.chunk_with_metadata(text, metadata_dict)
-            
-            # Return single document for short texts
-            return [{
-                "text": text,
-                "metadata": metadata_dict
-            }]
-        except Exception as e:
-            logger.error(f"Error processing message {message.get('_id', 'unknown')}: {str(e)}")
-            return []
+                long_texts.append(text)
+                long_metadatas.append(metadata)
+            else:
+                # Single document for short texts
+                documents.append({
+                    "text": text,
+                    "metadata": metadata
+                })
+
+        if long_texts:
+            logger.info(f"Chunking {len(long_texts)} messages longer than {MAX_TEXT_LENGTH} characters...")
+            documents.extend(self.chunker.chunk_with_metadata_batch(long_texts, long_metadatas))
+
+        return documents
+
+    def _upload_batch(self, documents: List[Dict], bulk: bool = False) -> None:
+        """Upload one batch of documents and log its throughput"""
+        started = time.perf_counter()
+        if bulk:
+            self.vector_store.add_documents_bulk(documents)
+        else:
+            self.vector_store.add_documents(documents)
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Uploaded {len(documents)} documents in {elapsed:.2f}s "
+            f"({len(documents) / max(elapsed, 1e-6):.1f} docs/s)"
+        )
+
+    def _upload_documents(self, documents: List[Dict], bulk: bool = False) -> None:
+        """Split documents into upload batches and send them concurrently"""
+        batches = [
+            documents[i:i + VECTOR_UPLOAD_BATCH_SIZE]
+            for i in range(0, len(documents), VECTOR_UPLOAD_BATCH_SIZE)
+        ]
+        # Consume the iterator so upload errors propagate
+        list(self.upload_executor.map(lambda batch: self._upload_batch(batch, bulk), batches))
+
+    def _backfill_timestamp_date(self) -> None:
+        """Persist timestamp.date as a BSON Date on messages that do not have it yet"""
+        result = self.messages_collection.update_many(
+            {"timestamp_date": {"$exists": False}, "timestamp.date": {"$exists": True}},
+            [{"$set": {"timestamp_date": {"$toDate": "$timestamp.date"}}}]
+        )
+        if result.modified_count:
+            logger.info(f"Backfilled timestamp_date on {result.modified_count} messages")
 
-    def process_messages(self, last_run: Optional[str] = None) -> bool:
+    def process_messages(self, last_run: Optional[float] = None) -> bool:
         """Process new messages since last run"""
         try:
+            # Make sure every message has the indexed timestamp_date field
+            self._backfill_timestamp_date()
+
             # Query for new messages
+            query = {}
             if last_run:
-                last_run_dt = datetime.fromisoformat(last_run)
-                logger.info(f"Querying messages after {last_run}")
-                pipeline = [
-                    {
-                        "$addFields": {
-                            "timestamp_date": {
-                                "$toDate": {
-                                    "$getField": {
-                                        "field": "date",
-                                        "input": "$timestamp"
-                                    }
-                                }
-                            }
-                        }
-                    },
-                    {
-                        "$match": {
-                            "timestamp_date": {"$gt": last_run_dt}
-                        }
-                    },
-                    {
-                        "$sort": {"timestamp_date": 1}
-                    }
-                ]
+                last_run_dt = datetime.fromtimestamp(last_run, timezone.utc)
+                query["timestamp_date"] = {"$gt": last_run_dt}
+                logger.info(f"Querying messages after {last_run_dt.isoformat()}")
             else:
                 logger.info("Processing all available messages")
-                pipeline = [
-                    {
-                        "$addFields": {
-                            "timestamp_date": {
-                                "$toDate": {
-                                    "$getField": {
-                                        "field": "date",
-                                        "input": "$timestamp"
-                                    }
-                                }
-                            }
-                        }
-                    },
-                    {
-                        "$sort": {"timestamp_date": 1}
-                    }
-                ]
-
-            messages = self.messages_collection.aggregate(pipeline)
-            messages_list = list(messages)
-            logger.info(f"Found {len(messages_list)} messages to process")
-
-            if not messages_list:
+
+            # Stream messages from MongoDB instead of loading them all into memory
+            cursor = self.messages_collection.find(query, projection=MESSAGE_PROJECTION).sort(
+                "timestamp_date", ASCENDING
+            ).hint(TIMESTAMP_DATE_INDEX).batch_size(MONGO_BATCH_SIZE)
+
+            message_count = 0
+            document_count = 0
+            # A run without last_run is a full backfill, so defer index builds until it ends
+            bulk = last_run is None
+            bulk_started = False
+            try:
+                if bulk:
+                    self.vector_store.begin_bulk()
+                    bulk_started = True
+                with cursor:
+                    while True:
+                        messages = list(islice(cursor, MONGO_BATCH_SIZE))
+                        if not messages:
+                            break
+
+                        # Build all documents of the batch so long texts are chunked together
+                        documents = self._build_documents(messages)
+                        if documents:
+                            self._upload_documents(documents, bulk)
+
+                        message_count += len(messages)
+                        document_count += len(documents)
+                        logger.info(f"Processed batch of {len(messages)} messages into {len(documents)} documents")
+            finally:
+                if bulk_started:
+                    self.vector_store.end_bulk()
+
+            if not message_count:
                 logger.info("No new messages to process")
                 return False
 
-            # Process each message
-            processed_count = 0
-            for message in messages_list:
-                chunks = self._process_message(message)
-                if chunks:
-                    self.vector_store.add_documents(chunks)
-                    processed_count += 1
-
-            logger.info(f"Successfully processed {processed_count} messages")
+            logger.info(f"Successfully processed {message_count} messages into {document_count} documents")
             return True
 
         except Exception as e:
-            logger.error(f"Error processing Telegram messages: {str(e)}", exc_info=True)
-            return False
-
-def process_telegram_data(last_run: Optional[str] = None) -> bool:
-    """Process Telegram data and return True if new data was processed"""
-    try:
-        # Initialize processor with MongoDB connection details from environment variables
-        logger.info(f"Initializing TelegramProcessor with last_run: {last_run}")
-        processor = TelegramProcessor()
-        return processor.process_messages(last_run)
-    except Exception as e:
-        logger.error(f"Error in process_telegram_data: {str(e)}", exc_info=True)
-        return False 
\ No newline at end of file
+            # Re-raise so the caller keeps the old last run time and retries this window
+            logger.error(f"Error processing Telegram messages: {str(e)}")
+            raise
+
+@lru_cache(maxsize=1)
+def get_telegram_processor() -> TelegramProcessor:
+    """Get the shared TelegramProcessor, creating it on first use"""
+    # Initialize processor with MongoDB connection details from environment variables
+    return TelegramProcessor()
+
+def process_telegram_data(last_run: Optional[float] = None) -> bool:
+    """Process Telegram data and return True if new data was processed.
+
+    Raises on failure so the caller does not advance the last run time.
+    """
+    logger.info(f"Processing Telegram data with last_run: {last_run}")
+    return get_telegram_processor().process_messages(last_run)
@@ -1,15 +1,21 @@
-from datetime import datetime
-from typing import List, Dict, Optional, Any
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Tuple
 import os
 import logging
 import time
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from workers.rag_processor.common.chunker import SemanticChunker
-from workers.rag_processor.common.vector_store import VectorStore
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from httpcore import ReadTimeout
+from motor.motor_asyncio import AsyncIOMotorClient
+from workers.rag_processor.common.chunker import create_chunker
+from workers.rag_processor.common.vector_store import (
+    VectorStore, VECTOR_UPLOAD_BATCH_SIZE, VECTOR_UPLOAD_CONCURRENCY
+)
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
+import httpx
+from qdrant_client.http.exceptions import ResponseHandlingException
 import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -17,160 +23,409 @@ logger = logging.getLogger(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
+# Texts longer than this are split into chunks
+MAX_TEXT_LENGTH = 10000
+# Metadata fields shared by every tweet document
+TWEET_METADATA_DEFAULTS = {
+    "source": "twitter",
+    "chat_type": "tweet",
+}
+# Number of tweets fetched from MongoDB and processed per batch
+MONGO_BATCH_SIZE = 500
+# Only the fields read by _prepare_tweet are fetched from MongoDB
+TWEET_PROJECTION = {
+    "_id": 0,
+    "text": 1,
+    "post_id": 1,
+    "user": 1,
+    "post_time": 1,
+    "keyword": 1,
+    "reposts": 1,
+    "likes": 1,
+}
+# Maximum number of fetched batches waiting to be processed
+QUEUE_MAX_BATCHES = 2
+# Upload errors that are retried and, if they persist, narrowed down by splitting the batch
+RETRYABLE_ERRORS = (httpx.TimeoutException, httpx.ConnectError, ConnectionError)
+# Number of ingested post_ids remembered across runs for deduplication
+MAX_REMEMBERED_POST_IDS = 100_000
+# Worker threads shared by the chunking and upload stages
+PROCESSING_WORKERS = int(os.getenv('RAG_PROCESSING_WORKERS', '2'))
+
+def _is_retryable(error: BaseException) -> bool:
+    """Check whether an upload error is a transient transport failure"""
+    # qdrant-client wraps transport errors, so look at the underlying exception
+    if isinstance(error, ResponseHandlingException):
+        error = error.source
+    return isinstance(error, RETRYABLE_ERRORS)
+
 class TwitterProcessor:
     def __init__(self, mongo_uri: str = None, db_name: str = None):
         """Initialize Twitter processor with MongoDB connection"""
-        self.client = MongoClient(
+        # The processor is reused across runs, so it owns the event loop the Motor client is bound to
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncIOMotorClient(
             mongo_uri or os.getenv('TWITTER_MONGODB_URI', 'mongodb://localhost:27017'),
             serverSelectionTimeoutMS=5000,  # 5 seconds timeout for server selection
             connectTimeoutMS=5000,  # 5 seconds timeout for connection
-            socketTimeoutMS=30000  # 30 seconds timeout for operations
+            socketTimeoutMS=30000,  # 30 seconds timeout for operations
+            io_loop=self.loop
         )
         self.db = self.client[db_name or os.getenv('TWITTER_MONGODB_DB_NAME', 'cpx-data')]
         self.tweets_collection = self.db["tweets"]
         self.airdrop_tweets_collection = self.db["airdrop_tweets"]
-        self.chunker = SemanticChunker(language='en')
+        self.checkpoints_collection = self.db["rag_checkpoints"]
+        # Documents that kept failing on their own, kept for inspection and replay
+        self.dead_letters_collection = self.db["rag_dead_letters"]
+        # post_ids ingested by earlier runs of this process, oldest first
+        self._ingested_post_ids: "OrderedDict[str, None]" = OrderedDict()
+        self.chunker = create_chunker(language='en')
         self.vector_store = VectorStore()
-        self.semaphore = asyncio.Semaphore(5)  # Giới hạn 5 luồng đồng thời
+        # Chunking/embedding and uploads release the GIL inside torch and the HTTP client
+        self.executor = ThreadPoolExecutor(
+            max_workers=PROCESSING_WORKERS + VECTOR_UPLOAD_CONCURRENCY,
+            thread_name_prefix="twitter-rag"
+        )
         logger.info("TwitterProcessor initialized")
 
-    def _get_safe_value(self, value: any, default: any = '') -> any:
-        """Get safe value from tweet field"""
-        return value if value is not None else default
-
-    def _get_safe_timestamp(self, tweet: Dict) -> int:
-        """Get safe timestamp as integer Unix timestamp"""
-        try:
-            post_time = tweet.get("post_time")
-            if post_time is None:
-                logger.warning(f"Tweet {tweet.get('post_id', 'unknown')} has no post_time, using current time")
-                return int(datetime.now().timestamp())
-            return int(post_time.timestamp())
-        except Exception as e:
-            logger.warning(f"Error getting timestamp for tweet {tweet.get('post_id', 'unknown')}: {str(e)}")
-            return int(datetime.now().timestamp())
-    
-    def _get_safe_post_time(self, tweet: Dict) -> str:
-        """Get safe post_time from tweet"""
+    def _normalize_post_time(self, tweet: Dict) -> Tuple[str, int]:
+        """Get post_time as an ISO string and an integer Unix timestamp"""
         try:
             post_time = tweet.get("post_time")
             if post_time is None:
                 logger.warning(f"Tweet {tweet.get('post_id', 'unknown')} has no post_time, using current time")
-                return datetime.now().isoformat()
-            return post_time.isoformat()
+                post_time = datetime.now()
+            return post_time.isoformat(), int(post_time.timestamp())
         except Exception as e:
             logger.warning(f"Error getting timestamp for tweet {tweet.get('post_id', 'unknown')}: {str(e)}")
-            return datetime.now().isoformat()
+            now = datetime.now()
+            return now.isoformat(), int(now.timestamp())
 
-    def _process_tweet(self, tweet: Dict) -> List[Dict]:
-        """Process a single tweet into vector store document"""
+    def _prepare_tweet(self, tweet: Dict) -> Optional[Tuple[str, Dict]]:
+        """Extract text and metadata from a single tweet"""
+        post_id = tweet.get("post_id")
         try:
             # Get text with fallback
-            text = self._get_safe_value(tweet.get("text", ""))
+            text = tweet.get("text") or ""
             if not text:
-                logger.warning(f"Skipping tweet {tweet.get('post_id', 'unknown')} - empty text")
-                return []
-            
-            metadata = {
-                "source": "twitter",
-                "keyword": self._get_safe_value(tweet.get("keyword", "")),
-                "post_id": str(self._get_safe_value(tweet.get("post_id", ""))),
-                "post_time": self._get_safe_post_time(tweet),
-                "sender": self._get_safe_value(tweet.get("user", "")),
-                "timestamp": self._get_safe_timestamp(tweet),
-                "chat_type": "tweet",
-                "retweet_count": int(self._get_safe_value(tweet.get("reposts", 0))),
-                "favorite_count": int(self._get_safe_value(tweet.get("likes", 0))),
+                logger.warning(f"Skipping tweet {post_id or 'unknown'} - empty text")
+                return None
+
+            post_time, timestamp = self._normalize_post_time(tweet)
+            metadata = TWEET_METADATA_DEFAULTS | {
+                "keyword": tweet.get("keyword") or "",
+                "post_id": str(post_id or ""),
+                "post_time": post_time,
+                "sender": tweet.get("user") or "",
+                "timestamp": timestamp,
+                "retweet_count": int(tweet.get("reposts") or 0),
+                "favorite_count": int(tweet.get("likes") or 0),
                 "original_text": text  # Store original text in metadata
             }
+            return text, metadata
+        except Exception as e:
+            logger.error(f"Error processing tweet {post_id or 'unknown'}: {str(e)}")
+            return None
 
+    def _build_documents(self, tweets: List[Dict]) -> List[Dict]:
+        """Turn tweets into vector store documents, chunking long texts in one batch"""
+        documents = []
+        long_texts = []
+        long_metadatas = []
+        for tweet in tweets:
+            prepared = self._prepare_tweet(tweet)
+            if prepared is None:
+                continue
+            text, metadata = prepared
             # Check text length and chunk if needed
-            MAX_TEXT_LENGTH = 10000  # Adjust this threshold as needed
             if len(text) > MAX_TEXT_LENGTH:
-                logger.info(f"Text length {len(text)} exceeds {MAX_TEXT_LENGTH}, chunking...")
-                return self.chunker.chunk_with_metadata(text, metadata)
-            
-            # Return single document for short texts
-            return [{
-                "text": text,
-                "metadata": metadata
-            }]
-        except Exception as e:
-            logger.error(f"Error processing tweet {tweet.get('post_id', 'unknown')}: {str(e)}")
-            return []
+                long_texts.append(text)
+                long_metadatas.append(metadata)
+            else:
+                # Single document for short texts
+                documents.append({
+                    "text": text,
+                    "metadata": metadata
+                })
+
+        if long_texts:
+            logger.info(f"Chunking {len(long_texts)} tweets longer than {MAX_TEXT_LENGTH} characters...")
+            documents.extend(self.chunker.chunk_with_metadata_batch(long_texts, long_metadatas))
+
+        return documents
+
+    async def _build_documents_parallel(self, tweets: List[Dict]) -> List[Dict]:
+        """Split tweets into one sub-batch per processing worker and build their documents concurrently"""
+        loop = asyncio.get_running_loop()
+        size = max(1, (len(tweets) + PROCESSING_WORKERS - 1) // PROCESSING_WORKERS)
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, self._build_documents, tweets[i:i + size])
+            for i in range(0, len(tweets), size)
+        ])
+        return [document for documents in results for document in documents]
 
     @retry(
-        stop=stop_after_attempt(3),  # Retry 3 times
+        stop=stop_after_attempt(2),  # Retry once before splitting the batch
         wait=wait_exponential(multiplier=1, min=4, max=10),  # Wait between retries
-        retry=retry_if_exception_type((ReadTimeout, ConnectionError)),  # Retry on timeout and connection errors
-        before_sleep=lambda retry_state: logger.warning(f"Retrying after error. Attempt {retry_state.attempt_number}/3")
+        retry=retry_if_exception(_is_retryable),  # Retry on timeout and connection errors
+        before_sleep=lambda retry_state: logger.warning(f"Retrying after error. Attempt {retry_state.attempt_number}/2"),
+        reraise=True
     )
-    def _add_to_vector_store(self, chunks: List[Dict]) -> None:
-        """Add documents to vector store with retry mechanism"""
-        self.vector_store.add_documents(chunks)
+    def _upsert_documents(self, chunks: List[Dict], bulk: bool) -> None:
+        """Upsert documents into the vector store with retry mechanism"""
+        if bulk:
+            self.vector_store.add_documents_bulk(chunks)
+        else:
+            self.vector_store.add_documents(chunks)
 
-    async def _process_tweet_with_semaphore(self, tweet: Dict[str, Any]) -> bool:
-        """Xử lý một tweet với semaphore để giới hạn số luồng đồng thời"""
-        async with self.semaphore:
-            try:
-                chunks = self._process_tweet(tweet)
-                if chunks:
-                    self._add_to_vector_store(chunks)
-                    return True
-            except Exception as e:
-                logger.error(f"Error processing tweet {tweet.get('post_id', 'unknown')}: {str(e)}")
+    def _qdrant_reachable(self) -> bool:
+        """Check whether Qdrant answers at all, to tell an outage from a bad document"""
+        try:
+            self.vector_store.client.get_collection(collection_name=self.vector_store.collection_name)
+            return True
+        except Exception:
             return False
 
-    async def process_tweets(self, last_run_time: Optional[str] = None) -> bool:
+    def _add_to_vector_store(self, chunks: List[Dict], bulk: bool = False) -> List[Dict]:
+        """Add documents to vector store, halving batches that keep failing; returns those that failed alone"""
+        try:
+            self._upsert_documents(chunks, bulk)
+            return []
+        except Exception as e:
+            if _is_retryable(e) and not self._qdrant_reachable():
+                # Qdrant itself is down: fail the run so the checkpoint stays put and the batch is retried
+                raise
+            if len(chunks) == 1:
+                # Isolated a bad document: hand it back for dead-lettering so it cannot stall ingestion
+                post_id = chunks[0]["metadata"].get("post_id", "unknown")
+                logger.error(f"Dead-lettering document for tweet {post_id} after repeated failures: {str(e)}")
+                return [{**chunks[0], "error": str(e)}]
+
+            # Split the batch so documents that upload fine are not resent with the failing one
+            middle = len(chunks) // 2
+            logger.warning(f"Splitting batch of {len(chunks)} documents after repeated failures")
+            return self._add_to_vector_store(chunks[:middle], bulk) + self._add_to_vector_store(chunks[middle:], bulk)
+
+    async def _upload_batch(self, documents: List[Dict], semaphore: asyncio.Semaphore, bulk: bool) -> List[Dict]:
+        """Upload one batch of documents, bounded by the upload semaphore; returns the failed documents"""
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            started = time.perf_counter()
+            failed = await loop.run_in_executor(self.executor, self._add_to_vector_store, documents, bulk)
+            elapsed = time.perf_counter() - started
+        logger.info(
+            f"Uploaded {len(documents) - len(failed)} documents in {elapsed:.2f}s "
+            f"({len(documents) / max(elapsed, 1e-6):.1f} docs/s)"
+        )
+        return failed
+
+    async def _upload_documents(self, documents: List[Dict], semaphore: asyncio.Semaphore, bulk: bool) -> List[Dict]:
+        """Split documents into upload batches and send them concurrently; returns the failed documents"""
+        results = await asyncio.gather(*[
+            self._upload_batch(documents[i:i + VECTOR_UPLOAD_BATCH_SIZE], semaphore, bulk)
+            for i in range(0, len(documents), VECTOR_UPLOAD_BATCH_SIZE)
+        ])
+        return [document for failed in results for document in failed]
+
+    async def _dead_letter(self, documents: List[Dict]) -> None:
+        """Record documents that could not be uploaded so they can be inspected and replayed"""
+        failed_at = datetime.now(timezone.utc)
+        await self.dead_letters_collection.insert_many([
+            {
+                "source": "twitter",
+                "post_id": document["metadata"].get("post_id"),
+                "text": document["text"],
+                "metadata": document["metadata"],
+                "error": document["error"],
+                "failed_at": failed_at
+            }
+            for document in documents
+        ])
+        logger.warning(f"Dead-lettered {len(documents)} documents to rag_dead_letters")
+
+    async def _load_checkpoint(self) -> Optional[datetime]:
+        """Get the post_time of the last tweet that was fully ingested"""
+        checkpoint = await self.checkpoints_collection.find_one({"source": "twitter"})
+        return checkpoint.get("last_post_time") if checkpoint else None
+
+    async def _save_checkpoint(self, last_post_time: datetime) -> None:
+        """Advance the ingestion checkpoint; $max keeps it from moving backwards"""
+        await self.checkpoints_collection.update_one(
+            {"source": "twitter"},
+            {"$max": {"last_post_time": last_post_time}},
+            upsert=True
+        )
+
+    def _deduplicate(self, tweets: List[Dict], seen: set) -> List[Dict]:
+        """Drop tweets whose post_id was already seen in this run or ingested by an earlier one"""
+        unique = []
+        for tweet in tweets:
+            post_id = tweet.get("post_id")
+            if post_id is not None:
+                post_id = str(post_id)
+                if post_id in seen or post_id in self._ingested_post_ids:
+                    continue
+                seen.add(post_id)
+            unique.append(tweet)
+        return unique
+
+    def _remember_ingested(self, tweets: List[Dict]) -> None:
+        """Record post_ids of uploaded tweets, keeping only the most recent ones"""
+        for tweet in tweets:
+            post_id = tweet.get("post_id")
+            if post_id is not None:
+                self._ingested_post_ids[str(post_id)] = None
+        while len(self._ingested_post_ids) > MAX_REMEMBERED_POST_IDS:
+            self._ingested_post_ids.popitem(last=False)
+
+    async def _flush_batch(
+        self,
+        tweets: List[Dict],
+        documents: List[Dict],
+        watermark: Optional[datetime],
+        semaphore: asyncio.Semaphore,
+        bulk: bool
+    ) -> None:
+        """Upload a batch of documents, then checkpoint its post_time watermark"""
+        if documents:
+            failed = await self._upload_documents(documents, semaphore, bulk)
+            if failed:
+                # Recorded before the checkpoint moves past them, so nothing is lost
+                await self._dead_letter(failed)
+        self._remember_ingested(tweets)
+        if watermark is not None:
+            await self._save_checkpoint(watermark)
+
+    async def _produce_batches(self, cursor, queue: asyncio.Queue) -> None:
+        """Stream tweet batches from MongoDB into the queue"""
+        cancelled = False
+        try:
+            batch = []
+            async for tweet in cursor:
+                batch.append(tweet)
+                if len(batch) >= MONGO_BATCH_SIZE:
+                    await queue.put(batch)
+                    batch = []
+            if batch:
+                await queue.put(batch)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # Nobody reads the queue after cancellation, so a put on a full queue would never return
+            if not cancelled:
+                await queue.put(None)
+
+    async def _consume_batches(self, queue: asyncio.Queue, bulk: bool) -> Tuple[int, int]:
+        """Process tweet batches from the queue and flush them to the vector store"""
+        upload_semaphore = asyncio.Semaphore(VECTOR_UPLOAD_CONCURRENCY)
+        seen = set()
+        tweet_count = 0
+        document_count = 0
+        pending_upload = None
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+
+                # Skip duplicates before spending any chunking/embedding work on them
+                tweets = self._deduplicate(batch, seen)
+                if len(tweets) < len(batch):
+                    logger.info(f"Skipped {len(batch) - len(tweets)} duplicate tweets")
+
+                # Chunk/embed on the worker pool so it overlaps with the previous upload
+                documents = await self._build_documents_parallel(tweets)
+
+                if pending_upload is not None:
+                    await pending_upload
+                    pending_upload = None
+                # Batches arrive sorted by post_time, so the last tweet holds the batch watermark
+                watermark = max((tweet["post_time"] for tweet in batch if tweet.get("post_time")), default=None)
+                pending_upload = asyncio.ensure_future(
+                    self._flush_batch(tweets, documents, watermark, upload_semaphore, bulk)
+                )
+
+                tweet_count += len(tweets)
+                document_count += len(documents)
+                logger.info(f"Processed batch of {len(tweets)} tweets into {len(documents)} documents")
+
+            if pending_upload is not None:
+                await pending_upload
+                pending_upload = None
+        finally:
+            if pending_upload is not None:
+                pending_upload.cancel()
+        return tweet_count, document_count
+
+    async def process_tweets(self, last_run_time: Optional[float] = None) -> bool:
         """Process tweets since last run time"""
         try:
-            # Build query based on last run time
+            # Resume from the ingestion checkpoint, falling back to the last run time
             query = {}
-            if last_run_time:
-                last_run = datetime.fromisoformat(last_run_time)
+            checkpoint = await self._load_checkpoint()
+            if checkpoint:
+                # Inclusive, since tweets sharing the watermark's post_time may have landed in a batch
+                # that never finished; re-reading the rest is harmless as point ids derive from the text
+                query["post_time"] = {"$gte": checkpoint}
+                logger.info(f"Querying tweets from checkpoint {checkpoint.isoformat()}")
+            elif last_run_time:
+                last_run = datetime.fromtimestamp(last_run_time, timezone.utc)
                 query["post_time"] = {"$gt": last_run}
-                logger.info(f"Querying tweets after {last_run_time}")
+                logger.info(f"Querying tweets after {last_run.isoformat()}")
             else:
                 logger.info("Processing all available tweets")
 
-            # Get tweets from MongoDB
-            tweets = list(self.tweets_collection.find(query).sort("post_time", -1))
-            # airdrop_tweets = list(self.airdrop_tweets_collection.find(query).sort("post_time", -1))
+            # Stream tweets from MongoDB instead of loading them all into memory
+            cursor = self.tweets_collection.find(
+                query, projection=TWEET_PROJECTION
+            ).sort("post_time", 1).batch_size(MONGO_BATCH_SIZE)
+            # airdrop_tweets = self.airdrop_tweets_collection.find(query).sort("post_time", 1)
 
-            # tweets.extend(airdrop_tweets)
-            logger.info(f"Found {len(tweets)} tweets to process")
+            # A run without last_run_time is a full backfill, so defer index builds until it ends
+            bulk = last_run_time is None
+            bulk_started = False
+            queue = asyncio.Queue(maxsize=QUEUE_MAX_BATCHES)
+            producer = asyncio.create_task(self._produce_batches(cursor, queue))
+            try:
+                if bulk:
+                    self.vector_store.begin_bulk()
+                    bulk_started = True
+                tweet_count, document_count = await self._consume_batches(queue, bulk)
+                await producer
+            finally:
+                producer.cancel()
+                # Wait for the producer to stop before closing the cursor it is reading from
+                await asyncio.gather(producer, return_exceptions=True)
+                await cursor.close()
+                if bulk_started:
+                    self.vector_store.end_bulk()
 
-            if not tweets:
+            if not tweet_count:
                 logger.info("No new tweets to process")
                 return False
 
-            # Tạo danh sách các task xử lý tweets
-            tasks = [self._process_tweet_with_semaphore(tweet) for tweet in tweets]
-            
-            # Chạy tất cả các task đồng thời và đợi kết quả
-            results = await asyncio.gather(*tasks)
-            
-            # Đếm số tweet được xử lý thành công
-            processed_count = sum(1 for result in results if result)
-            
-            logger.info(f"Processed {processed_count} tweets successfully")
+            logger.info(f"Processed {tweet_count} tweets into {document_count} documents successfully")
             return True
 
         except Exception as e:
-            logger.error(f"Error processing tweets: {str(e)}", exc_info=True)
-            return False
+            # Re-raise so the caller keeps the old last run time and retries this window
+            logger.error(f"Error processing tweets: {str(e)}")
+            raise
+
+    def run(self, last_run_time: Optional[float] = None) -> bool:
+        """Process tweets on the processor's own event loop"""
+        return self.loop.run_until_complete(self.process_tweets(last_run_time))
+
+@lru_cache(maxsize=1)
+def get_twitter_processor() -> TwitterProcessor:
+    """Get the shared TwitterProcessor, creating it on first use"""
+    # Initialize processor with MongoDB connection details from environment variables
+    return TwitterProcessor()
+
+def process_twitter_data(last_run_time: Optional[float] = None) -> bool:
+    """Process Twitter data since last run time and return True if data was processed.
 
-def process_twitter_data(last_run_time: Optional[str] = None) -> bool:
-    """Process Twitter data since last run time and return True if data was processed"""
-    try:
-        # Initialize processor with MongoDB connection details from environment variables
-        processor = TwitterProcessor()
-        # Create and run event loop for async execution
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(processor.process_tweets(last_run_time))
-        loop.close()
-        return result
-    except Exception as e:
-        logger.error(f"Error in process_twitter_data: {str(e)}", exc_info=True)
-        return False 
\ No newline at end of file
+    Raises on failure so the caller does not advance the last run time.
+    """
+    return get_twitter_processor().run(last_run_time)
@@ -1,17 +1,21 @@
-import json
+import asyncio
+import fcntl
 import os
-import time
 import logging
 import signal
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from apscheduler.schedulers.background import BackgroundScheduler
+import orjson
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
-from workers.rag_processor.jobs.twitter_job import process_twitter_data
-from workers.rag_processor.jobs.telegram_job import process_telegram_data
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,9 +23,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Width reserved for each value in last_run.json so it can be rewritten in place
+LAST_RUN_SLOT_WIDTH = 40
+
+# fdatasync skips metadata writes; fall back to fsync where it is unavailable (macOS)
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+class SchedulerLockedError(RuntimeError):
+    """Another scheduler instance already runs against the same rag_configs directory"""
+
+@lru_cache(maxsize=None)
+def _get_jobs():
+    """Import the source jobs and build their processors on first use"""
+    # The jobs pull in the embedding model, Qdrant and MongoDB clients
+    from workers.rag_processor.jobs.twitter_job import get_twitter_processor, process_twitter_data
+    from workers.rag_processor.jobs.telegram_job import get_telegram_processor, process_telegram_data
+    # Build the processors one after the other before the sources run concurrently,
+    # so the shared embedder and vector store are never initialized from two threads
+    get_twitter_processor()
+    get_telegram_processor()
+    return process_twitter_data, process_telegram_data
+
 class RAGProcessorScheduler:
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
+        # Coroutine jobs run on the event loop itself, so no scheduler thread pool is needed
+        self.scheduler = AsyncIOScheduler(
+            executors={'default': AsyncIOExecutor()},
+            # Never overlap runs; collapse missed runs into a single catch-up run
+            job_defaults={'max_instances': 1, 'coalesce': True, 'misfire_grace_time': 60}
+        )
+        # One thread per source so the blocking jobs never queue behind each other
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-src")
         
         # Check each level for rag_configs directory
         current_path = Path(__file__).parent
@@ -32,7 +64,7 @@ class RAGProcessorScheduler:
             config_dir = current_path / "rag_configs"
             if config_dir.exists():
                 rag_configs_dir = config_dir
-                logger.info(f"Found rag_configs directory at: {rag_configs_dir}")
+                logger.info("Found rag_configs directory at: %s", rag_configs_dir)
                 break
             current_path = current_path.parent
         
@@ -40,144 +72,312 @@ class RAGProcessorScheduler:
         if rag_configs_dir is None:
             rag_configs_dir = Path(__file__).parent.parent.parent / "rag_configs"
             rag_configs_dir.mkdir(parents=True, exist_ok=True)
-            logger.info(f"Created rag_configs directory at: {rag_configs_dir}")
+            logger.info("Created rag_configs directory at: %s", rag_configs_dir)
         
         self.last_run_file = rag_configs_dir / "last_run.json"
+        self.lock_file = self.last_run_file.with_suffix('.lock')
+        self.pid_file = rag_configs_dir / "scheduler.pid"
+        self._pid_fd = None
+        self._lock_depth = 0
+        self._slots = {}
+        self._last_saved_bytes = None
+        # Runs that found no new data are only persisted every N runs (and on shutdown)
+        self._persist_every = int(os.getenv('RAG_PERSIST_EVERY', '6'))
+        self._ticks_since_persist = 0
         self._load_last_run()
-        self._setup_signal_handlers()
-        self.is_running = False
+        # Set between start() and stop(); an Event gives well-defined visibility across threads
+        self._running = threading.Event()
+        self._shutdown_event = asyncio.Event()
+        self._received_signal = None
+        # Source runs in flight, awaited on shutdown so their timestamps are not lost
+        self._source_runs = set()
 
     def _setup_signal_handlers(self):
-        """Setup signal handlers for graceful shutdown"""
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        """Setup signal handlers for graceful shutdown on the running event loop"""
+        # Signals are only delivered to the main thread; an embedding process owns them otherwise
+        if threading.current_thread() is not threading.main_thread():
+            logger.info("Not running in the main thread, skipping signal handler setup")
+            return
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGINT, self._signal_handler, signal.SIGINT)
+        loop.add_signal_handler(signal.SIGTERM, self._signal_handler, signal.SIGTERM)
 
-    def _signal_handler(self, signum, frame):
+    def _signal_handler(self, signum):
         """Handle shutdown signals"""
-        logger.info(f"Received signal {signum}, initiating graceful shutdown...")
-        self.stop()
+        self._received_signal = signum
+        self._shutdown_event.set()
+
+    async def wait_for_shutdown(self):
+        """Wait until a shutdown signal is received"""
+        await self._shutdown_event.wait()
+        logger.info("Received signal %s, initiating graceful shutdown...", self._received_signal)
+
+    @contextmanager
+    def _last_run_lock(self):
+        """Hold an exclusive advisory lock on last_run.json shared with other processes"""
+        if self._lock_depth:
+            # Already held by this instance; flock would deadlock on a second descriptor
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+
+        with open(self.lock_file, 'w') as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _acquire_pid_file(self):
+        """Make sure only one scheduler instance runs against this rag_configs directory"""
+        fd = os.open(self.pid_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise SchedulerLockedError(
+                f"Another RAG processor scheduler already holds {self.pid_file}"
+            )
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._pid_fd = fd
+
+    def _release_pid_file(self):
+        """Release the single-instance lock taken in start()"""
+        if self._pid_fd is not None:
+            os.close(self._pid_fd)
+            self._pid_fd = None
 
     def _load_last_run(self):
         """Load last run timestamps from file"""
-        if self.last_run_file.exists():
-            with open(self.last_run_file, 'r') as f:
-                self.last_run = json.load(f)
-        else:
+        with self._last_run_lock():
+            self._read_last_run()
+            # Rewrite in the fixed-width slot layout so later saves can update values in place
+            self._save_last_run()
+
+    def _read_last_run(self):
+        """Read last run timestamps from file, defaulting to None for a first run"""
+        try:
+            with open(self.last_run_file, 'rb') as f:
+                stored = orjson.loads(f.read())
+            # Timestamps are UTC POSIX floats; convert values written in the older ISO format
+            # (naive strings were written in local time, which is how timestamp() reads them)
+            self.last_run = {
+                key: datetime.fromisoformat(value).timestamp() if isinstance(value, str) else value
+                for key, value in stored.items()
+            }
+        except FileNotFoundError:
             # Initialize with None to process all historical data on first run
             self.last_run = {
                 'twitter': None,
                 'telegram': None
             }
-            self._save_last_run()
+
+    def _render_last_run(self):
+        """Serialize last run timestamps with each value padded to a fixed-width slot"""
+        content = b'{'
+        slots = {}
+        for i, (key, value) in enumerate(self.last_run.items()):
+            if i:
+                content += b','
+            content += orjson.dumps(key) + b':'
+            encoded = orjson.dumps(value)
+            width = max(LAST_RUN_SLOT_WIDTH, len(encoded))
+            slots[key] = (len(content), width)
+            content += encoded.ljust(width)
+        content += b'}\n'
+        return content, slots
 
     def _save_last_run(self):
         """Save last run timestamps to file"""
+        with self._last_run_lock():
+            try:
+                buf, slots = self._render_last_run()
+                if buf == self._last_saved_bytes:
+                    return
+                # Write a temp file and rename it over the original so a crash never leaves a truncated file
+                tmp_file = self.last_run_file.with_suffix('.json.tmp')
+                with open(tmp_file, 'wb') as f:
+                    f.write(buf)
+                    f.flush()
+                    # Only the data has to be durable before the rename, not the file metadata
+                    _fdatasync(f.fileno())
+                os.replace(tmp_file, self.last_run_file)
+                self._slots = slots
+                self._last_saved_bytes = buf
+                logger.debug("Successfully saved last run timestamps")
+            except Exception as e:
+                logger.error("Error saving last run timestamps: %s", e)
+
+    def _save_field(self, key, value):
+        """Save one last run timestamp by overwriting its slot in place"""
+        with self._last_run_lock():
+            slot = self._slots.get(key)
+            if slot is not None and key in self.last_run and self.last_run[key] == value:
+                # Nothing changed since the last save
+                return
+            self.last_run[key] = value
+            encoded = orjson.dumps(value)
+            if slot is None or len(encoded) > slot[1]:
+                # New key or value too wide for its slot: fall back to a full rewrite
+                self._save_last_run()
+                return
+
+            offset, width = slot
+            data = encoded.ljust(width)
+            try:
+                fd = os.open(self.last_run_file, os.O_WRONLY)
+                try:
+                    os.pwrite(fd, data, offset)
+                finally:
+                    os.close(fd)
+                if self._last_saved_bytes is not None:
+                    # Keep the cached file contents in sync with the patched slot
+                    buf = self._last_saved_bytes
+                    self._last_saved_bytes = buf[:offset] + data + buf[offset + width:]
+                logger.debug("Successfully saved last run timestamp for %s", key)
+            except Exception as e:
+                logger.error("Error saving last run timestamp for %s: %s", key, e)
+                self._save_last_run()
+
+    async def _run_source(self, source, name, job, current_time):
+        """Run one source job and persist its last run timestamp as soon as it finishes"""
+        last_run = self.last_run.get(source)
+        logger.info("Processing %s data since %s", name, last_run)
+        loop = asyncio.get_running_loop()
         try:
-            with open(self.last_run_file, 'w') as f:
-                json.dump(self.last_run, f, indent=2)
-            logger.debug("Successfully saved last run timestamps")
+            result = await loop.run_in_executor(self._pool, job, last_run)
         except Exception as e:
-            logger.error(f"Error saving last run timestamps: {str(e)}")
+            # Keep the old timestamp so the next run retries this source only
+            logger.error("Error processing %s data, will retry on next run: %s", name, e, exc_info=True)
+            return
+
+        if result:
+            # New data was ingested, so persist right away
+            self._save_field(source, current_time)
+            logger.info("Successfully processed new %s data", name)
+        else:
+            # Losing this on a crash only re-scans an empty window; it is persisted in batches
+            self.last_run[source] = current_time
+            logger.info("No new %s data to process", name)
 
-    def process_all_sources(self):
+    async def process_all_sources(self):
         """Process data from all sources since last run"""
-        if not self.is_running:
-            logger.warning("Scheduler is not running, skipping processing")
+        if not self._running.is_set():
+            # A run fired while shutting down
             return
 
-        current_time = datetime.now().isoformat()
-        
+        current_time = time.time()
+        # Pay the one-off job import and setup cost off the event loop
         try:
-            # Process Twitter data
-            twitter_last_run = self.last_run.get('twitter')
-            logger.info(f"Processing Twitter data since {twitter_last_run}")
-            new_twitter_data = process_twitter_data(twitter_last_run)
-            self.last_run['twitter'] = current_time
-            if new_twitter_data:
-                logger.info("Successfully processed new Twitter data")
-            else:
-                logger.info("No new Twitter data to process")
-
-            # Process Telegram data
-            telegram_last_run = self.last_run.get('telegram')
-            logger.info(f"Processing Telegram data since {telegram_last_run}")
-            new_telegram_data = process_telegram_data(telegram_last_run)
-            self.last_run['telegram'] = current_time
-            if new_telegram_data:
-                logger.info("Successfully processed new Telegram data")
-            else:
-                logger.info("No new Telegram data to process")
-
-            # Save last run timestamps
-            self._save_last_run()
-            logger.info("Updated last run timestamps")
-
+            process_twitter_data, process_telegram_data = await asyncio.get_running_loop().run_in_executor(
+                self._pool, _get_jobs
+            )
         except Exception as e:
-            logger.error(f"Error processing data: {str(e)}", exc_info=True)
-            # Still update last run to avoid reprocessing the same data
-            self.last_run['twitter'] = current_time
-            self.last_run['telegram'] = current_time
+            # Nothing ran, so keep every timestamp and try again on the next run
+            logger.error("Error setting up source jobs: %s", e, exc_info=True)
+            return
+
+        # Both sources are I/O-bound and independent, so run them side by side
+        runs = [
+            asyncio.ensure_future(self._run_source('twitter', 'Twitter', process_twitter_data, current_time)),
+            asyncio.ensure_future(self._run_source('telegram', 'Telegram', process_telegram_data, current_time))
+        ]
+        for run in runs:
+            self._source_runs.add(run)
+            run.add_done_callback(self._source_runs.discard)
+        # Shielded so cancelling this scheduler job never abandons a run whose thread keeps going
+        await asyncio.shield(asyncio.gather(*runs))
+
+        self._ticks_since_persist += 1
+        if self._ticks_since_persist >= self._persist_every:
             self._save_last_run()
+            self._ticks_since_persist = 0
+        logger.info("Updated last run timestamps")
 
-    def start(self):
-        """Start the scheduler"""
-        if self.is_running:
+    async def start(self):
+        """Start the scheduler on the running event loop"""
+        if self._running.is_set():
             logger.warning("Scheduler is already running")
             return
 
+        # Raised before the try so a second instance is reported by the caller, not as a startup failure
+        self._acquire_pid_file()
         try:
-            # Run immediately on startup to process any missed data
-            self.is_running = True
-            self.process_all_sources()
-            
-            # Schedule regular runs
+            self._setup_signal_handlers()
+
+            self._running.set()
+            # Schedule regular runs, with the first one right away to process any missed data;
+            # it runs as a scheduler job so a shutdown signal is handled while it is in flight
             self.scheduler.add_job(
                 self.process_all_sources,
                 trigger=IntervalTrigger(minutes=5),
                 id='process_rag_data',
-                replace_existing=True
+                replace_existing=True,
+                next_run_time=datetime.now()
             )
             self.scheduler.start()
             logger.info("RAG Processor Scheduler started")
         except Exception as e:
-            self.is_running = False
-            logger.error(f"Error starting scheduler: {str(e)}", exc_info=True)
+            self._running.clear()
+            self._release_pid_file()
+            logger.error("Error starting scheduler: %s", e, exc_info=True)
             raise
 
-    def stop(self):
+    async def stop(self):
         """Stop the scheduler gracefully"""
-        if not self.is_running:
+        if not self._running.is_set():
             logger.warning("Scheduler is not running")
             return
 
         try:
             logger.info("Initiating graceful shutdown...")
-            self.is_running = False
-            
-            # Save current state
-            self._save_last_run()
+            self._running.clear()
             
+            # Wait for source jobs that are still running so their results are persisted;
+            # runs firing meanwhile return at once since _running is cleared
+            if self._source_runs:
+                logger.info("Waiting for %d running source jobs to finish...", len(self._source_runs))
+                await asyncio.gather(*self._source_runs, return_exceptions=True)
+
             # Shutdown scheduler
             if self.scheduler.running:
-                self.scheduler.shutdown(wait=True)
+                self.scheduler.shutdown(wait=False)
                 logger.info("Scheduler shutdown complete")
+
+            # Save current state
+            self._save_last_run()
+            self._pool.shutdown(wait=False)
             
             logger.info("Graceful shutdown completed")
         except Exception as e:
-            logger.error(f"Error during shutdown: {str(e)}", exc_info=True)
+            logger.error("Error during shutdown: %s", e, exc_info=True)
         finally:
-            # Ensure we exit cleanly
-            sys.exit(0)
+            self._release_pid_file()
 
-if __name__ == "__main__":
+async def main():
     scheduler = RAGProcessorScheduler()
     try:
-        scheduler.start()
-        while True:
-            time.sleep(1)
+        await scheduler.start()
+    except SchedulerLockedError as e:
+        # Exit non-zero so supervisors do not treat a refused start as a clean exit
+        logger.error("%s", e)
+        sys.exit(1)
+
+    try:
+        await scheduler.wait_for_shutdown()
+        await scheduler.stop()
+    except Exception as e:
+        logger.error("Unexpected error: %s", e, exc_info=True)
+        await scheduler.stop()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt")
-        scheduler.stop()
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-        scheduler.stop() 
\ No newline at end of file
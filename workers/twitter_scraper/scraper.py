@@ -1,15 +1,20 @@
 import os
-import json
 import time
 import asyncio
+import logging
 import signal
-import schedule
-import requests
+import httpx
+import orjson
 import sys
+from collections import OrderedDict
+from contextlib import aclosing
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 from dotenv import load_dotenv
 from twscrape import API, gather
+from twscrape.account import Account, TOKEN
 from twscrape.logger import set_log_level
 
 # Load environment variables
@@ -21,7 +26,26 @@ client = MongoClient(MONGO_URI)
 db_name = os.getenv('DB_NAME', 'cpx-data')
 db = client[db_name]
 db_collection = os.getenv('DB_COLLECTION', 'tweets')
-tweets_collection = db[db_collection]
+# Tweet upserts are idempotent and rewritten on every scrape, so don't wait for acknowledgement
+tweets_collection = db.get_collection(db_collection, write_concern=WriteConcern(w=0, j=False))
+
+# Unique index so upserts by post_id are index lookups instead of collection scans,
+# plus a per-user timeline index for downstream queries (created with the default write concern)
+try:
+    db[db_collection].create_index([('post_id', ASCENDING)], unique=True, background=True)
+    db[db_collection].create_index([('user', ASCENDING), ('post_time', ASCENDING)], background=True)
+except Exception as e:
+    print(f"Error creating tweet indexes: {e}")
+
+# Max upserts per bulk_write call, keeping each request well under the 16MB message limit
+BULK_WRITE_BATCH_SIZE = 1000
+
+# Tweets buffered per user before they are written to MongoDB
+TWEET_FLUSH_SIZE = 50
+
+# Fields refreshed by a re-scrape; tweets whose values are unchanged are not rewritten
+ENGAGEMENT_FIELDS = ('likes', 'total_comments', 'reposts', 'quotes')
+ENGAGEMENT_PROJECTION = {'_id': 0, 'post_id': 1, **{field: 1 for field in ENGAGEMENT_FIELDS}}
 
 # Directory configuration
 BASE_DIR = os.path.dirname(__file__)
@@ -36,11 +60,36 @@ PROXY_CACHE_FILE = os.path.join(CONFIG_DIR, "proxy.txt")
 ACCOUNTS_FILE = os.path.join(CONFIG_DIR, "accounts.txt")
 USERS_FILE = os.path.join(CONFIG_DIR, "users.txt")
 
+# Shared twscrape connection pools kept open: the current proxy's and the previous one's
+MAX_SHARED_TRANSPORTS = 2
+
+# Seconds between scraping jobs
+JOB_INTERVAL = 300
+
 # Proxy configuration
 USE_PROXY = os.getenv('USE_PROXY', 'true').lower() == 'true'
 
+# Requests each account may send per GraphQL endpoint in one rate limit window; twscrape names
+# its queues after these endpoints and locks an account on one once Twitter reports it exhausted
+ENDPOINT_RATE_LIMITS = {
+    'SearchTimeline': 50,
+    'UserTweets': 50,
+    'UserByScreenName': 95,
+    'UserByRestId': 500,
+    'TweetDetail': 150,
+}
+DEFAULT_ENDPOINT_RATE_LIMIT = 50
+RATE_LIMIT_WINDOW = 15 * 60  # seconds
+# Requests an account may send back to back on one endpoint before pacing kicks in
+RATE_LIMIT_BURST = 5
+
 # Set logging level
 set_log_level("ERROR")
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
 
 class ProxyManager:
     def __init__(self):
@@ -48,6 +97,17 @@ class ProxyManager:
         self.expiry_time = 0
         self.last_check_time = 0
         self.check_interval = 30  # Check proxy every 30 seconds
+        # Reuse connections to the proxy API instead of a new TCP/TLS handshake per fetch
+        self.session = httpx.Client(
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+            timeout=10.0
+        )
+        # Async client used while scraping so proxy fetches don't block the event loop
+        self._fetch_lock = asyncio.Lock()
+        self.async_session = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=4),
+            timeout=10.0
+        )
         if USE_PROXY:
             self.load_cached_proxy()
             print("Proxy is enabled")
@@ -60,8 +120,8 @@ class ProxyManager:
             
         try:
             if os.path.exists(PROXY_CACHE_FILE):
-                with open(PROXY_CACHE_FILE, 'r') as f:
-                    data = json.load(f)
+                with open(PROXY_CACHE_FILE, 'rb') as f:
+                    data = orjson.loads(f.read())
                     if data['expiry_time'] > time.time():
                         self.current_proxy = data['proxy']
                         self.expiry_time = data['expiry_time']
@@ -78,8 +138,8 @@ class ProxyManager:
             return
             
         try:
-            with open(PROXY_CACHE_FILE, 'w') as f:
-                json.dump(proxy_data, f)
+            with open(PROXY_CACHE_FILE, 'wb') as f:
+                f.write(orjson.dumps(proxy_data))
         except Exception as e:
             print(f"Error saving proxy cache: {e}")
 
@@ -100,6 +160,27 @@ class ProxyManager:
             
         return False
 
+    def _handle_proxy_response(self, data):
+        """Store the proxy from a proxy API response and return it"""
+        if data['status'] == 100:
+            # Extract expiry time from message (format: "proxy nay se die sau Xs")
+            expiry_seconds = int(data['message'].split('sau')[1].split('s')[0].strip())
+            self.expiry_time = time.time() + expiry_seconds
+            self.current_proxy = data['proxyhttp']
+            self.last_check_time = time.time()
+            
+            # Cache the proxy
+            self.save_proxy_cache({
+                'proxy': self.current_proxy,
+                'expiry_time': self.expiry_time
+            })
+            
+            print(f"Got new proxy, expires in {expiry_seconds} seconds")
+            return self.current_proxy
+        else:
+            print(f"Error response from proxy API: {data}")
+            return None
+
     def get_proxy(self):
         """Get current proxy or fetch new one if needed"""
         if not USE_PROXY:
@@ -108,28 +189,9 @@ class ProxyManager:
         if self.should_update_proxy():
             try:
                 print("Fetching new proxy...")
-                response = requests.get(PROXY_API_URL, timeout=10)
-                data = response.json()
-                
-                if data['status'] == 100:
-                    # Extract expiry time from message (format: "proxy nay se die sau Xs")
-                    expiry_seconds = int(data['message'].split('sau')[1].split('s')[0].strip())
-                    self.expiry_time = time.time() + expiry_seconds
-                    self.current_proxy = data['proxyhttp']
-                    self.last_check_time = time.time()
-                    
-                    # Cache the proxy
-                    self.save_proxy_cache({
-                        'proxy': self.current_proxy,
-                        'expiry_time': self.expiry_time
-                    })
-                    
-                    print(f"Got new proxy, expires in {expiry_seconds} seconds")
-                    return self.current_proxy
-                else:
-                    print(f"Error response from proxy API: {data}")
-                    return None
-            except requests.exceptions.Timeout:
+                response = self.session.get(PROXY_API_URL)
+                return self._handle_proxy_response(orjson.loads(response.content))
+            except httpx.TimeoutException:
                 print("Timeout while fetching proxy")
                 return None
             except Exception as e:
@@ -138,6 +200,67 @@ class ProxyManager:
         
         return self.current_proxy
 
+    async def get_proxy_async(self):
+        """Get current proxy or fetch new one if needed, without blocking the event loop"""
+        if not USE_PROXY:
+            return None
+            
+        if self.should_update_proxy():
+            # Concurrent users share one fetch; whoever waited re-checks after the first one finished
+            async with self._fetch_lock:
+                if self.should_update_proxy():
+                    try:
+                        print("Fetching new proxy...")
+                        response = await self.async_session.get(PROXY_API_URL)
+                        return self._handle_proxy_response(orjson.loads(response.content))
+                    except httpx.TimeoutException:
+                        print("Timeout while fetching proxy")
+                        return None
+                    except Exception as e:
+                        print(f"Error fetching proxy: {e}")
+                        return None
+        
+        return self.current_proxy
+
+    async def close(self):
+        """Close the proxy API connections"""
+        self.session.close()
+        await self.async_session.aclose()
+
+class SharedTransport(httpx.AsyncHTTPTransport):
+    """Connection pool shared by twscrape's per-query clients; closing a client keeps it open"""
+    async def aclose(self):
+        pass
+
+    async def __aexit__(self, exc_type=None, exc_value=None, traceback=None):
+        # `async with client` exits the transport directly instead of calling aclose
+        pass
+
+    async def close_pool(self):
+        """Close the pooled connections"""
+        await super().aclose()
+
+class AsyncTokenBucket:
+    """Token bucket that lets calls through up to capacity and only waits once credits run out"""
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, credits=1):
+        """Wait until enough credits are available and consume them"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+                self.updated_at = now
+                if self.tokens >= credits:
+                    self.tokens -= credits
+                    return
+                await asyncio.sleep((credits - self.tokens) / self.refill_per_second)
+
 class TwitterScraper:
     def __init__(self):
         print("Initializing TwitterScraper...")
@@ -146,10 +269,17 @@ class TwitterScraper:
         
         self.tweet_limit = 200
         self.retry_count = 3
-        self.retry_delay = 5
+        # Paces every Twitter API request, including pages and retries, per (account, endpoint)
+        self._rate_limiters = {}
         self.running = True
         self.current_task = None
         self.max_concurrent_users = 5  # Số lượng user tối đa chạy đồng thời
+        self._users_cache = (None, [])  # (mtime of USERS_FILE, usernames)
+        self._proxy = None  # Last proxy string seen and the URL built from it
+        self._proxy_url = None
+        self._transports = OrderedDict()  # proxy URL -> SharedTransport, most recent last
+        self._direct_transport = None  # Pool for clients without a proxy, e.g. account logins
+        self._closing_transports = set()
         
         # Create event loop
         self.loop = asyncio.new_event_loop()
@@ -160,8 +290,7 @@ class TwitterScraper:
         proxy = self.proxy_manager.get_proxy()
         if proxy:
             try:
-                host, port, proxy_user, proxy_pass = proxy.split(':')
-                proxy_url = f"http://{proxy_user}:{proxy_pass}@{host}:{port}"
+                proxy_url = self._build_proxy_url(proxy)
                 self.api = API(proxy=proxy_url)
                 print(f"API initialized with proxy: {proxy_url}")
             except Exception as e:
@@ -172,6 +301,8 @@ class TwitterScraper:
             self.api = API()
             print("API initialized without proxy")
         
+        self._share_client_connections()
+
         print("Setting up accounts...")
         self.setup_accounts()
         print("Accounts setup completed")
@@ -180,19 +311,120 @@ class TwitterScraper:
         self.loop.run_until_complete(self.login_accounts())
         print("Account login completed")
 
-    def update_proxy(self):
+    def _share_client_connections(self):
+        """Make twscrape's clients reuse one keep-alive HTTP/2 connection pool per proxy"""
+        # twscrape 0.17 builds and closes a new httpx client for every query, so every
+        # query would otherwise pay a fresh TCP/TLS handshake to the Twitter API
+        scraper = self
+
+        def make_shared_client(account, proxy=None):
+            # Mirrors Account.make_client, but on the shared pool instead of a new transport
+            proxy = next((p for p in (proxy, os.getenv("TWS_PROXY"), account.proxy) if p is not None), None)
+
+            async def pace_request(request):
+                # Every page of a timeline is its own request, so pace each one
+                path = request.url.path
+                if "/graphql/" in path:
+                    await scraper._get_rate_limiter(account.username, path.rsplit("/", 1)[-1]).acquire()
+
+            client = httpx.AsyncClient(
+                transport=scraper._get_transport(proxy),
+                follow_redirects=True,
+                event_hooks={"request": [pace_request]}
+            )
+
+            # saved from previous usage
+            client.cookies.update(account.cookies)
+            client.headers.update(account.headers)
+
+            # default settings
+            client.headers["user-agent"] = account.user_agent
+            client.headers["content-type"] = "application/json"
+            client.headers["authorization"] = TOKEN
+            client.headers["x-twitter-active-user"] = "yes"
+            client.headers["x-twitter-client-language"] = "en"
+
+            if "ct0" in client.cookies:
+                client.headers["x-csrf-token"] = client.cookies["ct0"]
+
+            return client
+
+        Account.make_client = make_shared_client
+
+    def _get_rate_limiter(self, username, endpoint):
+        """Get the token bucket pacing one account's requests to one endpoint"""
+        limiter = self._rate_limiters.get((username, endpoint))
+        if limiter is None:
+            limit = ENDPOINT_RATE_LIMITS.get(endpoint, DEFAULT_ENDPOINT_RATE_LIMIT)
+            # Burst plus refill over a window stays within the endpoint's limit
+            limiter = AsyncTokenBucket(RATE_LIMIT_BURST, (limit - RATE_LIMIT_BURST) / RATE_LIMIT_WINDOW)
+            self._rate_limiters[(username, endpoint)] = limiter
+        return limiter
+
+    def _get_transport(self, proxy_url):
+        """Get the shared transport for a proxy, closing the pool of proxies rotated out"""
+        if proxy_url is None:
+            # Kept out of the LRU so proxy-less clients never evict the active proxy's pool
+            if self._direct_transport is None:
+                self._direct_transport = self._new_transport(None)
+            return self._direct_transport
+
+        transport = self._transports.get(proxy_url)
+        if transport is None:
+            transport = self._new_transport(proxy_url)
+            self._transports[proxy_url] = transport
+            # Keep the previous proxy's pool for queries still running on it
+            while len(self._transports) > MAX_SHARED_TRANSPORTS:
+                _, old = self._transports.popitem(last=False)
+                task = asyncio.get_running_loop().create_task(old.close_pool())
+                self._closing_transports.add(task)
+                task.add_done_callback(self._closing_transports.discard)
+        else:
+            self._transports.move_to_end(proxy_url)
+        return transport
+
+    def _new_transport(self, proxy_url):
+        """Build a keep-alive HTTP/2 connection pool for a proxy"""
+        return SharedTransport(
+            proxy=proxy_url,
+            http2=True,
+            retries=3,
+            limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+        )
+
+    async def close_transports(self):
+        """Close every shared twscrape connection pool"""
+        if self._closing_transports:
+            await asyncio.gather(*self._closing_transports, return_exceptions=True)
+        transports = list(self._transports.values())
+        self._transports.clear()
+        if self._direct_transport is not None:
+            transports.append(self._direct_transport)
+            self._direct_transport = None
+        for transport in transports:
+            await transport.close_pool()
+
+    def _build_proxy_url(self, proxy):
+        """Build the proxy URL from a host:port:user:password string, re-parsing only when it changes"""
+        if proxy != self._proxy:
+            host, port, proxy_user, proxy_pass = proxy.split(':')
+            self._proxy_url = f"http://{proxy_user}:{proxy_pass}@{host}:{port}"
+            self._proxy = proxy
+        return self._proxy_url
+
+    async def update_proxy(self):
         """Update proxy configuration for the API"""
         if not USE_PROXY:
             return True
             
-        proxy = self.proxy_manager.get_proxy()
+        proxy = await self.proxy_manager.get_proxy_async()
         if proxy:
             try:
-                host, port, proxy_user, proxy_pass = proxy.split(':')
-                proxy_url = f"http://{proxy_user}:{proxy_pass}@{host}:{port}"
-                # Create new API instance with new proxy
-                self.api = API(proxy=proxy_url)
-                print(f"Updated API with new proxy: {proxy_url}")
+                proxy_url = self._build_proxy_url(proxy)
+                # Keep the API and its account pool; twscrape reads the proxy for every new client
+                if self.api.proxy != proxy_url:
+                    self.api.proxy = proxy_url
+                    print(f"Updated API with new proxy: {proxy_url}")
                 return True
             except Exception as e:
                 print(f"Error setting proxy: {e}")
@@ -236,7 +468,9 @@ class TwitterScraper:
                             
                         username, password, code, email, email_password = parts
                         print(f"Adding account: {username}")
-                        asyncio.run(self.api.pool.add_account(username, password, email, email_password, mfa_code=code))
+                        self.loop.run_until_complete(
+                            self.api.pool.add_account(username, password, email, email_password, mfa_code=code)
+                        )
                         print(f"Successfully added account: {username}")
                     except Exception as e:
                         print(f"Error adding account at line {line_num}: {str(e)}")
@@ -318,42 +552,28 @@ class TwitterScraper:
             except Exception as e2:
                 print(f"Error getting basic account info: {e2}")
 
-    async def get_tweets(self, username):
-        """Get tweets for a user using twscrape"""
+    async def iter_tweets(self, username):
+        """Yield tweets for a user using twscrape as they are fetched"""
         try:
             # Update proxy before making requests
-            if not self.update_proxy():
+            if not await self.update_proxy():
                 print(f"Failed to update proxy for {username}, retrying...")
-                return []
+                return
             
-            # Check account status first with timeout
-            try:
-                async with asyncio.timeout(30):  # 30 seconds timeout
-                    await self.check_account_status()
-            except asyncio.TimeoutError:
-                print("Timeout while checking account status")
-                return []
+            # Account status is checked once per job in scrape_user_tweets, so only look up the active account
+            accounts = await self.api.pool.accounts_info()
+            current_account = next((acc for acc in accounts if acc['active']), None)
+            if current_account:
+                print(f"Using account: {current_account['username']}")
             
             print(f"\nTrying to find user: {username}")
             # Search for the target user
             try:
-                # Get current account info before search
-                accounts = await self.api.pool.accounts_info()
-                current_account = next((acc for acc in accounts if acc['active']), None)
-                if current_account:
-                    print(f"Using account: {current_account['username']}")
-                
                 users = await gather(self.api.search_user(username))
                 
-                # Get account info after search to check if it switched
-                accounts_after = await self.api.pool.accounts_info()
-                current_account_after = next((acc for acc in accounts_after if acc['active']), None)
-                if current_account_after and current_account and current_account_after['username'] != current_account['username']:
-                    print(f"Account switched from {current_account['username']} to {current_account_after['username']}")
-                
                 if not users:
                     print(f"Could not find user: {username}")
-                    return []
+                    return
                     
                 target_user = users[0]
                 print(f"Found target user: {target_user.username} (ID: {target_user.id})")
@@ -363,62 +583,60 @@ class TwitterScraper:
                 print(f"Error details: {traceback.format_exc()}")
                 # Force proxy update on error
                 self.proxy_manager.current_proxy = None
-                return []
+                return
             
             # Get tweets using user_id with timeout
-            tweets = []
             last_proxy_check = time.time()
             proxy_check_interval = 30  # Check proxy every 30 seconds during tweet fetching
+            # 60 seconds budget for getting tweets; only time spent waiting on fetches is charged,
+            # not the time the caller spends handling each yielded tweet
+            loop = asyncio.get_running_loop()
+            fetch_budget = 60
+            user_tweets = None
             
             try:
-                async with asyncio.timeout(60):  # 60 seconds timeout for getting tweets
-                    # Get current account info before fetching tweets
-                    accounts = await self.api.pool.accounts_info()
-                    current_account = next((acc for acc in accounts if acc['active']), None)
-                    if current_account:
-                        print(f"Using account for tweets: {current_account['username']}")
-                    
-                    async for tweet in self.api.user_tweets(target_user.id, limit=self.tweet_limit):
-                        if not self.running:  # Check if we should stop
-                            print("Received stop signal, stopping tweet collection")
+                user_tweets = self.api.user_tweets(target_user.id, limit=self.tweet_limit)
+                while True:
+                    started = loop.time()
+                    async with asyncio.timeout(fetch_budget):
+                        try:
+                            tweet = await anext(user_tweets)
+                        except StopAsyncIteration:
                             break
-                            
-                        # Check and update proxy if needed
-                        current_time = time.time()
-                        if current_time - last_proxy_check >= proxy_check_interval:
-                            print(f"[{username}] Checking proxy status...")
-                            if self.proxy_manager.should_update_proxy():
-                                print(f"[{username}] Updating proxy during tweet fetching...")
-                                if not self.update_proxy():
-                                    print(f"[{username}] Failed to update proxy, stopping tweet collection")
-                                    break
-                            last_proxy_check = current_time
-                            
-                        # Print raw tweet data for debugging
-                        print(f"[{username}] Raw tweet data: {tweet.id_str}")
+                    fetch_budget -= loop.time() - started
+
+                    if not self.running:  # Check if we should stop
+                        print("Received stop signal, stopping tweet collection")
+                        break
                         
-                        tweet_data = {
-                            'user': username,
-                            'post_id': tweet.id,
-                            'post_link': f"https://x.com/{username}/status/{tweet.id}",
-                            'text': tweet.rawContent.strip(),
-                            'post_time': tweet.date,
-                            'likes': tweet.likeCount,
-                            'total_comments': tweet.replyCount,
-                            'reposts': tweet.retweetCount,
-                            'quotes': tweet.quoteCount,
-                            'comments': [],
-                            'updated_at': datetime.now().isoformat()
-                        }
-                        tweets.append(tweet_data)
-                        print(f"Processed tweet: {tweet_data['post_id']} - {tweet_data['text'][:100]}...")
-                    
-                    # Get account info after fetching tweets to check if it switched
-                    accounts_after = await self.api.pool.accounts_info()
-                    current_account_after = next((acc for acc in accounts_after if acc['active']), None)
-                    if current_account_after and current_account and current_account_after['username'] != current_account['username']:
-                        print(f"Account switched from {current_account['username']} to {current_account_after['username']} during tweet fetching")
+                    # Check and update proxy if needed
+                    current_time = time.time()
+                    if current_time - last_proxy_check >= proxy_check_interval:
+                        print(f"[{username}] Checking proxy status...")
+                        if self.proxy_manager.should_update_proxy():
+                            print(f"[{username}] Updating proxy during tweet fetching...")
+                            if not await self.update_proxy():
+                                print(f"[{username}] Failed to update proxy, stopping tweet collection")
+                                break
+                        last_proxy_check = current_time
                         
+                    tweet_data = {
+                        'user': username,
+                        'post_id': tweet.id,
+                        'post_link': f"https://x.com/{username}/status/{tweet.id}",
+                        'text': tweet.rawContent.strip(),
+                        'post_time': tweet.date,
+                        'likes': tweet.likeCount,
+                        'total_comments': tweet.replyCount,
+                        'reposts': tweet.retweetCount,
+                        'quotes': tweet.quoteCount,
+                        'comments': [],
+                        'updated_at': datetime.now().isoformat()
+                    }
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Processed tweet: %s - %s...", tweet_data['post_id'], tweet_data['text'][:100])
+                    yield tweet_data
+
             except asyncio.TimeoutError:
                 print("Timeout while getting tweets")
             except Exception as e:
@@ -427,15 +645,50 @@ class TwitterScraper:
                 print(f"Error details: {traceback.format_exc()}")
                 # Force proxy update on error
                 self.proxy_manager.current_proxy = None
-                
-            return tweets
+            finally:
+                if user_tweets is not None:
+                    await user_tweets.aclose()
         except Exception as e:
             print(f"Error getting tweets: {e}")
             import traceback
             print(f"Error details: {traceback.format_exc()}")
             # Force proxy update on error
             self.proxy_manager.current_proxy = None
-            return []
+
+    def save_tweets(self, username, tweets):
+        """Upsert tweets that are new or whose engagement counts changed"""
+        existing = {
+            doc['post_id']: doc
+            for doc in tweets_collection.find(
+                {'post_id': {'$in': [tweet['post_id'] for tweet in tweets]}},
+                projection=ENGAGEMENT_PROJECTION
+            )
+        }
+        changed = [
+            tweet for tweet in tweets
+            if tweet['post_id'] not in existing
+            or any(existing[tweet['post_id']].get(field) != tweet[field] for field in ENGAGEMENT_FIELDS)
+        ]
+        if len(changed) < len(tweets):
+            print(f"[{username}] Skipping {len(tweets) - len(changed)} unchanged tweets")
+
+        # Upsert the tweets in as few round-trips as possible
+        ops = [
+            UpdateOne({'post_id': tweet['post_id']}, {'$set': tweet}, upsert=True)
+            for tweet in changed
+        ]
+        for i in range(0, len(ops), BULK_WRITE_BATCH_SIZE):
+            try:
+                batch = ops[i:i + BULK_WRITE_BATCH_SIZE]
+                result = tweets_collection.bulk_write(batch, ordered=False)
+                if result.acknowledged:
+                    print(f"[{username}] Inserted {result.upserted_count} new tweets, updated {result.modified_count} existing tweets")
+                else:
+                    print(f"[{username}] Sent {len(batch)} tweet upserts")
+            except BulkWriteError as e:
+                print(f"[{username}] Error saving {len(e.details['writeErrors'])} tweets to MongoDB: {e.details['writeErrors'][0]['errmsg']}")
+            except Exception as e:
+                print(f"[{username}] Error saving tweets to MongoDB: {e}")
 
     async def process_user_tweets(self, username):
         """Process tweets for a single user"""
@@ -447,88 +700,85 @@ class TwitterScraper:
             try:
                 print(f"Attempt {attempt + 1}/{self.retry_count} for {username}")
                 # Update proxy before each attempt
-                self.update_proxy()
+                await self.update_proxy()
                 
-                # Get tweets using asyncio with timeout
+                # Stream tweets into MongoDB in small batches while they are fetched
+                saved = 0
+                buffer = []
                 try:
-                    tweets = await asyncio.wait_for(self.get_tweets(username), timeout=12000)
+                    async with asyncio.timeout(12000), aclosing(self.iter_tweets(username)) as tweets:
+                        async for tweet in tweets:
+                            if not self.running:
+                                print(f"Received stop signal, stopping save to MongoDB for {username}")
+                                return
+                            buffer.append(tweet)
+                            if len(buffer) >= TWEET_FLUSH_SIZE:
+                                # pymongo blocks, so write on a worker thread while other users keep scraping
+                                await asyncio.to_thread(self.save_tweets, username, buffer)
+                                saved += len(buffer)
+                                buffer = []
                 except asyncio.TimeoutError:
                     print(f"Timeout while scraping tweets for {username}")
-                    continue
                 except Exception as e:
-                    print(f"Error in get_tweets for {username}: {e}")
-                    continue
-
-                # Save to MongoDB
-                if tweets:
-                    for tweet in tweets:
-                        if not self.running:
-                            print(f"Received stop signal, stopping save to MongoDB for {username}")
-                            return
-                            
-                        try:
-                            result = tweets_collection.update_one(
-                                {'post_id': tweet['post_id']},
-                                {'$set': tweet},
-                                upsert=True
-                            )
-                            if result.upserted_id:
-                                print(f"[{username}] Inserted new tweet: {tweet['post_id']}")
-                            elif result.modified_count > 0:
-                                print(f"[{username}] Updated existing tweet: {tweet['post_id']}")
-                        except Exception as e:
-                            print(f"[{username}] Error saving tweet {tweet['post_id']} to MongoDB: {e}")
-                            continue
-                            
-                    print(f"Saved {len(tweets)} tweets for user {username}")
-                    return  # Success, exit the retry loop
+                    print(f"Error in iter_tweets for {username}: {e}")
+
+                if buffer:
+                    await asyncio.to_thread(self.save_tweets, username, buffer)
+                    saved += len(buffer)
+
+                if saved:
+                    print(f"Saved {saved} tweets for user {username}")
                 else:
                     print(f"No tweets found for user {username}")
-                    return
+                return
 
             except Exception as e:
                 print(f"Attempt {attempt + 1}/{self.retry_count} failed for {username}: {e}")
                 if attempt < self.retry_count - 1:
-                    print(f"Retrying in {self.retry_delay} seconds...")
-                    await asyncio.sleep(self.retry_delay)
+                    print("Retrying...")
                     # Force proxy update on retry
                     self.proxy_manager.current_proxy = None
                 else:
                     print(f"All attempts failed for {username}")
 
-    async def process_users_batch(self, usernames):
-        """Process a batch of users concurrently"""
-        tasks = []
-        for username in usernames:
-            if not self.running:
-                break
-            task = asyncio.create_task(self.process_user_tweets(username))
-            tasks.append(task)
-        
-        if tasks:
-            await asyncio.gather(*tasks)
+    def load_usernames(self):
+        """Read usernames from USERS_FILE, re-parsing only when the file has changed"""
+        mtime = os.stat(USERS_FILE).st_mtime
+        if mtime != self._users_cache[0]:
+            with open(USERS_FILE, 'r') as f:
+                # Drop duplicate usernames while keeping the file order, so nobody is scraped twice per job
+                usernames = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+            self._users_cache = (mtime, usernames)
+        return self._users_cache[1]
+
+    async def process_users(self, usernames):
+        """Process users concurrently, keeping up to max_concurrent_users in flight"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_users)
+
+        async def process_with_semaphore(username):
+            async with semaphore:
+                if not self.running:
+                    return
+                await self.process_user_tweets(username)
 
-    def scrape_user_tweets(self, usernames):
+        await asyncio.gather(*(process_with_semaphore(username) for username in usernames))
+
+    async def scrape_user_tweets(self, usernames):
         """Scrape tweets for multiple users concurrently"""
         if not self.running:
             return
 
-        # Process users in batches to control concurrency
-        for i in range(0, len(usernames), self.max_concurrent_users):
-            if not self.running:
-                break
-                
-            batch = usernames[i:i + self.max_concurrent_users]
-            print(f"\nProcessing batch of {len(batch)} users...")
-            
-            # Run the batch processing using the same event loop
-            self.loop.run_until_complete(self.process_users_batch(batch))
-            
-            if not self.running:
-                break
-                
-            # Add a small delay between batches
-            time.sleep(2)
+        # Check account status once per job instead of before every user
+        try:
+            async with asyncio.timeout(30):  # 30 seconds timeout
+                await self.check_account_status()
+        except asyncio.TimeoutError:
+            print("Timeout while checking account status")
+            return
+
+        # A slow user only holds its own slot instead of stalling a whole batch
+        print(f"\nProcessing {len(usernames)} users, {self.max_concurrent_users} at a time...")
+        await self.process_users(usernames)
 
 def signal_handler(signum, frame):
     """Handle shutdown signals"""
@@ -553,21 +803,20 @@ def main():
         print(f"Error details: {traceback.format_exc()}")
         return
     
-    def job():
+    async def job_async():
         if not scraper.running:
             return
             
         try:
             print("\nStarting new scraping job...")
-            if not os.path.exists(USERS_FILE):
+            try:
+                usernames = scraper.load_usernames()
+            except FileNotFoundError:
                 print(f"Please create {USERS_FILE} with Twitter usernames to scrape")
                 return
-                
-            with open(USERS_FILE, 'r') as f:
-                usernames = [line.strip() for line in f if line.strip()]
             
             print(f"Found {len(usernames)} users to process")
-            scraper.scrape_user_tweets(usernames)
+            await scraper.scrape_user_tweets(usernames)
                 
             print("Job completed successfully")
         except Exception as e:
@@ -575,29 +824,26 @@ def main():
             import traceback
             print(f"Error details: {traceback.format_exc()}")
 
-    # Schedule the job to run every 5 minutes
-    schedule.every(5).minutes.do(job)
-    
+    async def run_jobs():
+        # Run immediately on start, then every 5 minutes without waking up in between
+        while scraper.running:
+            await job_async()
+            if scraper.running:
+                await asyncio.sleep(JOB_INTERVAL)
+
     print("Twitter scraper is running. Press Ctrl+C to stop.")
     print("First job will start immediately...")
     
-    # Run immediately on start
-    job()
-    
-    # Keep the script running
-    while scraper.running:
-        try:
-            schedule.run_pending()
-            time.sleep(1)
-        except KeyboardInterrupt:
-            print("\nReceived keyboard interrupt. Shutting down...")
-            scraper.stop()
-            break
-        except Exception as e:
-            print(f"Error in main loop: {e}")
-            import traceback
-            print(f"Error details: {traceback.format_exc()}")
-            time.sleep(5)  # Wait before retrying
+    # Drive every job on the scraper's loop so connection pools stay warm across users and runs
+    try:
+        scraper.loop.run_until_complete(run_jobs())
+    except KeyboardInterrupt:
+        print("\nReceived keyboard interrupt. Shutting down...")
+        scraper.stop()
+    except Exception as e:
+        print(f"Error in main loop: {e}")
+        import traceback
+        print(f"Error details: {traceback.format_exc()}")
     
     # Cleanup before exit
     print("\nCleaning up resources...")
@@ -605,6 +851,10 @@ def main():
         # Close MongoDB connection
         client.close()
         print("MongoDB connection closed")
+
+        # Close proxy API and Twitter API connections
+        scraper.loop.run_until_complete(scraper.proxy_manager.close())
+        scraper.loop.run_until_complete(scraper.close_transports())
         
         # Close any open files
         if os.path.exists(PROXY_CACHE_FILE):